@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Per-backend benchmark harness for the download backend registry.
+
+Every backend of the default registry (or the ones selected with --backend)
+is warmed and then downloads the same URLs, so backends can be compared and
+tuned in one place. Without --url a local throttled HTTP server from
+bench_parallel_download is started and its file is used.
+
+Usage: python benchmarks/bench_backends.py [--url URL --platform youtube] [--backend parallel] [--runs 3]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import threading
+from http.server import ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.backends import create_registry
+
+
+def serve_local_file(size_mb: float, rate_kb: int) -> str:
+    """Start a throttled local server and return the URL of its file."""
+    from bench_parallel_download import make_handler
+
+    payload = os.urandom(int(size_mb * 1024 * 1024))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(payload, rate_kb * 1024, 512 * 1024))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", action="append", help="video URL, can be repeated")
+    parser.add_argument("--platform", default="unknown", help="platform of the URLs (youtube, instagram, tiktok)")
+    parser.add_argument("--backend", action="append", help="backend to benchmark, can be repeated")
+    parser.add_argument("--runs", type=int, default=3, help="downloads per backend and URL")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent requests per download")
+    parser.add_argument("--size-mb", type=float, default=8, help="size of the local test file")
+    parser.add_argument("--rate-kb", type=int, default=1024, help="per-connection rate of the local server")
+    args = parser.parse_args()
+
+    urls = args.url or [serve_local_file(args.size_mb, args.rate_kb)]
+    registry = create_registry(workers=args.workers)
+    names = args.backend or registry.names()
+
+    print(f"{'backend':<12} {'warm':>8} {'median':>8} {'MB/s':>8} {'ok':>6}  url")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            backend = registry.get(name)
+            if backend is None:
+                print(f"{name:<12} unknown backend, available: {', '.join(registry.names())}")
+                continue
+
+            start = time.perf_counter()
+            try:
+                backend.warm()
+            except Exception as e:
+                print(f"{name:<12} failed to warm: {e}")
+                continue
+            warm_time = time.perf_counter() - start
+
+            for url in urls:
+                if not backend.supports(args.platform, url):
+                    print(f"{name:<12} {warm_time:8.2f} {'-':>8} {'-':>8} {'-':>6}  {url} (platform not supported)")
+                    continue
+
+                times, sizes = [], []
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    result = registry.download(url, args.platform, tmp, names=[name])
+                    elapsed = time.perf_counter() - start
+                    if result:
+                        times.append(elapsed)
+                        sizes.append(result.file_size)
+                        os.remove(result.file_path)
+
+                if times:
+                    median = statistics.median(times)
+                    throughput = statistics.median(sizes) / median / 1024 / 1024
+                    print(f"{name:<12} {warm_time:8.2f} {median:8.2f} {throughput:8.2f} "
+                          f"{len(times):>3}/{args.runs:<2}  {url}")
+                else:
+                    print(f"{name:<12} {warm_time:8.2f} {'-':>8} {'-':>8} {0:>3}/{args.runs:<2}  {url}")
+
+
+if __name__ == "__main__":
+    main()
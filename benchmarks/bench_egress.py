@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Egress pool benchmark against local proxy stand-ins.
+
+A throttled local HTTP server from bench_parallel_download plays the
+platform CDN and several local forward proxies play the egresses. Each
+proxy answers 429 Too Many Requests once more than --limit requests went
+through it within --window seconds, like a platform throttling one source
+IP. The same batch of jobs is run through a single unpaced proxy, a single
+paced proxy and the paced pool, and the pool health is printed in the
+metrics format.
+
+Usage: python benchmarks/bench_egress.py [--proxies 3] [--jobs 12] [--limit 20] [--window 5]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import http.client
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.backends import BackendRegistry, DownloadBackend, DownloadResult
+from utils.egress import Egress, EgressPool
+from utils.parallel_download import SessionPool, ParallelDownloader
+
+PLATFORM = "instagram"
+
+
+def make_proxy_handler(limit: int, window: float):
+    """Forward proxy for plain HTTP that throttles after `limit` requests per `window` seconds."""
+    hits = deque()
+    lock = threading.Lock()
+
+    class ProxyHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _throttled(self) -> bool:
+            now = time.monotonic()
+            with lock:
+                while hits and hits[0] <= now - window:
+                    hits.popleft()
+                if len(hits) >= limit:
+                    return True
+                hits.append(now)
+                return False
+
+        def do_GET(self):
+            if self._throttled():
+                body = b"Too Many Requests"
+                self.send_response(429)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            target = urlsplit(self.path)
+            upstream = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+            headers = {name: value for name, value in self.headers.items()
+                       if name.lower() not in ("proxy-connection", "connection")}
+            upstream.request("GET", target.path or "/", headers=headers)
+            response = upstream.getresponse()
+            self.send_response(response.status)
+            for name, value in response.getheaders():
+                if name.lower() not in ("connection", "transfer-encoding"):
+                    self.send_header(name, value)
+            self.end_headers()
+            while True:
+                block = response.read(64 * 1024)
+                if not block:
+                    break
+                self.wfile.write(block)
+            upstream.close()
+
+    return ProxyHandler
+
+
+class QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients drop connections to throttled proxies, that is expected here
+        pass
+
+
+def serve(handler) -> int:
+    server = QuietServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+class DirectHttpBackend(DownloadBackend):
+    """Downloads the URL itself with the parallel engine, one session pool per egress."""
+
+    name = "direct_http"
+
+    def __init__(self, workers: int, chunk_size: int):
+        super().__init__()
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._downloaders = {}
+        self._lock = threading.Lock()
+
+    def _downloader(self, egress):
+        key = egress.name if egress else None
+        with self._lock:
+            if key not in self._downloaders:
+                pool = SessionPool(verify=False, proxy=egress.proxy if egress else None)
+                self._downloaders[key] = ParallelDownloader(pool, workers=self.workers, chunk_size=self.chunk_size)
+            return self._downloaders[key]
+
+    def download(self, url, platform, output_dir, download_id, egress=None):
+        output_file = os.path.join(output_dir, f"{download_id}.mp4")
+        self._downloader(egress).download(url, output_file)
+        return DownloadResult(output_file, download_id, self.name, platform)
+
+
+def run_jobs(registry: BackendRegistry, url: str, jobs: int, concurrency: int, output_dir: str):
+    def job(_):
+        start = time.perf_counter()
+        result = registry.download(url, PLATFORM, output_dir)
+        if result:
+            os.remove(result.file_path)
+        return result is not None, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(job, range(jobs)))
+    elapsed = time.perf_counter() - start
+    succeeded = [duration for ok, duration in outcomes if ok]
+    return len(succeeded), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--proxies", type=int, default=3, help="number of proxy stand-ins in the pool")
+    parser.add_argument("--jobs", type=int, default=12, help="downloads per run")
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs running at once")
+    parser.add_argument("--limit", type=int, default=20, help="requests a proxy allows per window")
+    parser.add_argument("--window", type=float, default=5, help="throttling window of a proxy in seconds")
+    parser.add_argument("--size-mb", type=float, default=0.5, help="size of the test file")
+    parser.add_argument("--rate-kb", type=int, default=4096, help="per-connection rate of the origin server")
+    parser.add_argument("--verbose", action="store_true", help="show the pool's log messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    # Every job sends a probe and one request per range, pace jobs to stay under the proxy limit
+    chunk_size = 128 * 1024
+    requests_per_job = 1 + -(-int(args.size_mb * 1024 * 1024) // chunk_size)
+    pacing = args.window * requests_per_job / args.limit
+
+    from bench_parallel_download import make_handler
+
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    origin = serve(make_handler(payload, args.rate_kb * 1024, 256 * 1024))
+    url = f"http://127.0.0.1:{origin}/video.mp4"
+    proxies = [f"http://127.0.0.1:{serve(make_proxy_handler(args.limit, args.window))}"
+               for _ in range(args.proxies)]
+
+    print(f"{args.jobs} jobs, {args.concurrency} at once, every proxy allows "
+          f"{args.limit} requests per {args.window:g} s\n")
+    print(f"{'setup':<24} {'ok':>7} {'total s':>8}")
+    runs = (
+        ("single proxy, unpaced", proxies[:1], 0),
+        (f"single proxy, {pacing:.2f} s", proxies[:1], pacing),
+        (f"pool of {len(proxies)}, {pacing:.2f} s", proxies, pacing),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, egresses, interval in runs:
+            # Let the throttling windows of the previous run expire
+            time.sleep(args.window)
+            pool = EgressPool([Egress.parse(proxy) for proxy in egresses],
+                              {PLATFORM: interval}, cooldown=args.window)
+            registry = BackendRegistry(pool)
+            registry.register(DirectHttpBackend(workers=2, chunk_size=chunk_size))
+            succeeded, elapsed = run_jobs(registry, url, args.jobs, args.concurrency, tmp)
+            print(f"{label:<24} {succeeded:>3}/{args.jobs:<3} {elapsed:8.2f}")
+
+        print("\nPool health after the last run:\n")
+        print(pool.render_metrics())
+
+
+if __name__ == "__main__":
+    main()
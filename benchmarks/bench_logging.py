@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the per-message logging overhead on the calling thread.
+
+Compares the previous synchronous setup (eagerly formatted f-strings written
+to a file by the caller) with the queue-based pipeline from utils.log, in
+text and JSON form, and the cost of disabled and sampled DEBUG calls.
+Only the time spent in the logging call is counted; the time the listener
+needs to drain the queue is reported separately. A per-write latency can be
+added to the log file to simulate a busy disk.
+
+Usage: python benchmarks/bench_logging.py [--messages 20000] [--disk-latency-us 100]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.log import setup_logging, stop_logging, log_context
+
+URL = "https://www.youtube.com/shorts/dQw4w9WgXcQ"
+logger = logging.getLogger("bench")
+
+
+def simulate_disk_latency(latency: float) -> None:
+    """Make every flush of a log file take at least `latency` seconds."""
+    flush = logging.StreamHandler.flush
+
+    def slow_flush(self):
+        flush(self)
+        if latency and getattr(self, "baseFilename", None):
+            time.sleep(latency)
+
+    logging.StreamHandler.flush = slow_flush
+
+
+def reset_root() -> None:
+    stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def measure(label: str, messages: int, log_call, drain=None) -> None:
+    start = time.perf_counter_ns()
+    for i in range(messages):
+        log_call(i)
+    elapsed = time.perf_counter_ns() - start
+
+    drain_start = time.perf_counter()
+    if drain:
+        drain()
+    drained = time.perf_counter() - drain_start
+
+    line = f"{label:<44} {elapsed / messages / 1000:8.2f} us/msg"
+    if drain:
+        line += f"   (listener drain {drained * 1000:7.1f} ms)"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--disk-latency-us", type=float, default=100,
+                        help="simulated latency of every log file write")
+    args = parser.parse_args()
+    n = args.messages
+    simulate_disk_latency(args.disk_latency_us / 1e6)
+    print(f"{n} messages, {args.disk_latency_us:g} us simulated latency per log file write\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, "bot.log")
+        devnull = open(os.devnull, "w")
+        real_stderr = sys.stderr
+
+        # Previous setup: synchronous file handler and eager f-strings
+        reset_root()
+        logging.basicConfig(
+            level=logging.INFO, filename=log_file,
+            format='%(asctime)s | %(levelname)-8s | %(name)s:%(funcName)s:%(lineno)d - %(message)s'
+        )
+        measure("sync handler, f-string", n,
+                lambda i: logger.info(f"Загрузка YouTube видео через pytube: {URL} ({i})"))
+        measure("sync handler, DEBUG disabled, f-string", n,
+                lambda i: logger.debug(f"Fetched range {i}-{i + 1} of {URL}"))
+
+        for fmt in ("text", "json"):
+            reset_root()
+            sys.stderr = devnull
+            setup_logging("INFO", fmt, log_file)
+            sys.stderr = real_stderr
+
+            def info(i):
+                logger.info("Загрузка YouTube видео через pytube: %s (%d)", URL, i)
+
+            measure(f"queue pipeline ({fmt}), lazy %-format", n, info, stop_logging)
+            sys.stderr = devnull
+            setup_logging("INFO", fmt, log_file)
+            sys.stderr = real_stderr
+            with log_context(job_id="job-1", platform="YouTube", backend="pytube"):
+                measure(f"queue pipeline ({fmt}), with job context", n, info, stop_logging)
+
+        reset_root()
+        sys.stderr = devnull
+        setup_logging("INFO", "json", log_file)
+        sys.stderr = real_stderr
+        measure("queue pipeline, DEBUG disabled, %-format", n,
+                lambda i: logger.debug("Fetched range %d-%d of %s", i, i + 1, URL), stop_logging)
+
+        reset_root()
+        sys.stderr = devnull
+        setup_logging("DEBUG", "json", log_file, debug_sample_rate=100)
+        sys.stderr = real_stderr
+        measure("queue pipeline, DEBUG sampled 1/100", n,
+                lambda i: logger.debug("Fetched range %d-%d of %s", i, i + 1, URL), stop_logging)
+
+        reset_root()
+        devnull.close()
+
+
+if __name__ == "__main__":
+    main()
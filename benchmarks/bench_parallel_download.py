@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the parallel download engine against a local throttled HTTP server.
+
+The server limits every connection to a fixed rate, like CDNs that throttle
+per connection, and supports range requests. The same file is downloaded
+with one stream and with several concurrent ranges.
+
+Usage: python benchmarks/bench_parallel_download.py [--size-mb 8] [--rate-kb 1024]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.parallel_download import BandwidthLimiter, SessionPool, ParallelDownloader
+
+
+def make_handler(payload: bytes, rate: int, fragment_size: int):
+    class ThrottledHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_body(self, body: bytes) -> None:
+            # Send in 16 KB blocks, sleeping to keep this connection at `rate`
+            block = 16 * 1024
+            for offset in range(0, len(body), block):
+                self.wfile.write(body[offset:offset + block])
+                time.sleep(block / rate)
+
+        def do_GET(self):
+            if self.path.startswith("/fragment/"):
+                index = int(self.path.rsplit("/", 1)[1])
+                body = payload[index * fragment_size:(index + 1) * fragment_size]
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self._send_body(body)
+                return
+
+            range_header = self.headers.get("Range")
+            if range_header:
+                start, end = range_header.split("=", 1)[1].split("-")
+                start, end = int(start), min(int(end), len(payload) - 1)
+                body = payload[start:end + 1]
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+            else:
+                body = payload
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self._send_body(body)
+
+    return ThrottledHandler
+
+
+def run(label: str, func, expected: bytes, dest: str) -> float:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    with open(dest, "rb") as f:
+        assert f.read() == expected, f"{label}: downloaded file differs from the source"
+    print(f"{label:<32} {elapsed:6.2f} s  {len(expected) / elapsed / 1024 / 1024:6.2f} MB/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=8, help="size of the served file")
+    parser.add_argument("--rate-kb", type=int, default=1024, help="per-connection rate limit of the server")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent requests per download")
+    parser.add_argument("--chunk-kb", type=int, default=512, help="range size")
+    args = parser.parse_args()
+
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    fragment_size = args.chunk_kb * 1024
+    handler = make_handler(payload, args.rate_kb * 1024, fragment_size)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    fragments = [f"{base_url}/fragment/{i}" for i in range((len(payload) + fragment_size - 1) // fragment_size)]
+
+    pool = SessionPool(per_host_connections=args.workers)
+    single = ParallelDownloader(pool, BandwidthLimiter(), workers=1, chunk_size=fragment_size)
+    parallel = ParallelDownloader(pool, BandwidthLimiter(), workers=args.workers, chunk_size=fragment_size)
+
+    print(f"{args.size_mb} MB file, server limited to {args.rate_kb} KB/s per connection\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, "video.mp4")
+        baseline = run("single stream", lambda: single.download(f"{base_url}/video.mp4", dest), payload, dest)
+        ranged = run(f"{args.workers} concurrent ranges",
+                     lambda: parallel.download(f"{base_url}/video.mp4", dest), payload, dest)
+        fragmented = run(f"{args.workers} concurrent fragments",
+                         lambda: parallel.download_fragments(fragments, dest), payload, dest)
+
+    print(f"\nspeedup: ranges x{baseline / ranged:.1f}, fragments x{baseline / fragmented:.1f}")
+    pool.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
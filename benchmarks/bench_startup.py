@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark of the bot entry point.
+
+Measures, in fresh interpreters, how long the bot takes from start to its
+first getUpdates call: importing the entry module, then simple_bot.main()
+up to the moment the update loop asks Telegram for updates (telepot import,
+journal open, logging setup, starting the loop). The bot is replaced by a
+stub whose getUpdates stops the clock, so no token or network is needed;
+telepot itself is still imported when installed. Also reports the import
+time alone and the background pre-warm of the download backends. Exits with
+status 1 if the median time to the first getUpdates exceeds the budget, so
+it can gate rolling restarts.
+
+Usage: python benchmarks/bench_startup.py [--module simple_bot] [--runs 10] [--budget 1.0]
+"""
+import os
+import re
+import sys
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_TIME_RE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)")
+
+
+# Runs simple_bot.main() with a bot whose first getUpdates call prints the
+# elapsed time and ends the process. The real create_bot still runs, so the
+# telepot import stays on the measured path when telepot is installed
+_MAIN_CODE = """
+import os, time
+start = time.perf_counter()
+import simple_bot
+
+real_create_bot = simple_bot.create_bot
+
+class StubBot:
+    def getUpdates(self, *args, **kwargs):
+        print(time.perf_counter() - start, flush=True)
+        os._exit(0)
+
+def create_bot(token):
+    try:
+        real_create_bot(token)
+        print("telepot: imported", flush=True)
+    except ImportError:
+        print("telepot: not installed, not measured", flush=True)
+    return StubBot()
+
+simple_bot.create_bot = create_bot
+simple_bot.main()
+"""
+
+
+def timed_run(code: str, env_overrides: dict = None) -> float:
+    """Run code in a fresh interpreter and return the seconds it reports."""
+    return float(run(code, env_overrides)[-1])
+
+
+def run(code: str, env_overrides: dict = None) -> list:
+    """Run code in a fresh interpreter and return its output lines."""
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "benchmark"), **(env_overrides or {}))
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True, timeout=60
+    ).stdout
+    return output.strip().splitlines()
+
+
+def heaviest_imports(module: str, count: int):
+    """Return the top-level imports of module with the largest cumulative time."""
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "benchmark"))
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stderr
+    # Children are printed before their parent, collect the direct children
+    # of each top-level import until the measured module itself shows up
+    children = []
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME_RE.match(line)
+        if not match:
+            continue
+        cumulative_seconds = int(match.group(1)) / 1e6
+        depth = (len(match.group(2)) - 1) // 2
+        if depth == 1:
+            children.append((cumulative_seconds, match.group(3)))
+        elif depth == 0:
+            if match.group(3) == module:
+                return sorted(children, reverse=True)[:count]
+            children = []
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="simple_bot", help="entry module to import")
+    parser.add_argument("--runs", type=int, default=10, help="number of fresh interpreters")
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="allowed median time to the first getUpdates (import time for other modules)")
+    args = parser.parse_args()
+
+    import_code = (
+        "import time; start = time.perf_counter(); "
+        f"import {args.module}; print(time.perf_counter() - start)"
+    )
+    import_times = [timed_run(import_code) for _ in range(args.runs)]
+    median = statistics.median(import_times)
+    measured = "import time"
+
+    print(f"import {args.module}: median {median * 1000:.1f} ms, "
+          f"min {min(import_times) * 1000:.1f} ms, max {max(import_times) * 1000:.1f} ms "
+          f"over {args.runs} runs")
+
+    if args.module == "simple_bot":
+        main_times, notes = [], set()
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(args.runs):
+                # A fresh journal and temp directory every run, as on a first start
+                lines = run(_MAIN_CODE, {
+                    "JOURNAL_PATH": os.path.join(tmp, f"journal-{i}.sqlite3"),
+                    "TEMP_PATH": os.path.join(tmp, "temp"),
+                    "LOG_FILE": "",
+                    "METRICS_PORT": "0",
+                })
+                main_times.append(float(lines[-1]))
+                notes.update(line for line in lines[:-1] if line.startswith("telepot:"))
+        median = statistics.median(main_times)
+        measured = "time to the first getUpdates"
+        print(f"main() to first getUpdates: median {median * 1000:.1f} ms, "
+              f"min {min(main_times) * 1000:.1f} ms, max {max(main_times) * 1000:.1f} ms "
+              f"over {args.runs} runs ({'; '.join(sorted(notes))})")
+
+    print("\nheaviest direct imports:")
+    for elapsed, name in heaviest_imports(args.module, 8):
+        print(f"  {elapsed * 1000:8.1f} ms  {name}")
+
+    if args.module == "simple_bot":
+        prewarm_code = (
+            "import time, simple_bot; start = time.perf_counter(); "
+            "simple_bot.prewarm_backends(); print(time.perf_counter() - start)"
+        )
+        try:
+            prewarm = timed_run(prewarm_code)
+            print(f"\nbackground pre-warm (off the serving path): {prewarm * 1000:.1f} ms")
+        except subprocess.CalledProcessError as e:
+            print(f"\nbackground pre-warm failed: {e.stderr.strip().splitlines()[-1]}")
+
+    if median > args.budget:
+        print(f"\nFAIL: median {measured} exceeds the {args.budget:.2f} s budget")
+        sys.exit(1)
+    print(f"\nOK: within the {args.budget:.2f} s budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,20 @@ from telegram.ext import ContextTypes
 from loguru import logger
 
 from utils import VideoDownloader, extract_urls, is_supported_url, get_clean_url
+from utils.postprocess import VideoProcessor
+from utils.log import log_context
 from config import settings
 
 # Initialize video downloader
 downloader = VideoDownloader()
 
+# Initialize ffmpeg post-processing pool
+processor = VideoProcessor(
+    settings.processed_cache_path,
+    max_workers=settings.ffmpeg_workers,
+    cache_size_mb=settings.processed_cache_size_mb,
+)
+
 def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a welcome message when the command /start is issued."""
     user = update.effective_user
@@ -59,53 +68,11 @@ def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             "⏳ Начинаю загрузку видео... Это может занять некоторое время."
         )
         
-        try:
-            # Download the video
-            video_info = downloader.download(clean_url)
-            
-            if not video_info or not os.path.exists(video_info['file_path']):
-                status_message.edit_text(
-                    "❌ Не удалось загрузить видео. Возможно, оно недоступно или приватное."
-                )
-                return
-            
-            # Check file size
-            file_size_bytes = os.path.getsize(video_info['file_path'])
-            file_size_mb = file_size_bytes / (1024 * 1024)
-            
-            if file_size_mb > settings.max_file_size_mb:
-                status_message.edit_text(
-                    f"❌ Видео слишком большое ({file_size_mb:.1f} MB). "
-                    f"Максимальный размер: {settings.max_file_size_mb} MB."
-                )
-                # Clean up the downloaded file
-                downloader.cleanup(video_info['file_path'])
-                return
-            
-            # Update status
-            status_message.edit_text("📤 Загружаю видео в Telegram...")
-            
-            # Send the video
-            with open(video_info['file_path'], 'rb') as video_file:
-                update.message.reply_video(
-                    video=video_file,
-                    caption=f"📹 {video_info['title']}",
-                    supports_streaming=True,
-                )
-            
-            # Update status message
-            status_message.edit_text("✅ Видео успешно загружено!")
-            
-            # Clean up the downloaded file
-            downloader.cleanup(video_info['file_path'])
-            return
-            
-        except Exception as e:
-            logger.error(f"Error processing video: {str(e)}")
-            status_message.edit_text(
-                "❌ Произошла ошибка при обработке видео. Пожалуйста, попробуйте другую ссылку."
-            )
-            return
+        # Job fields are attached to every record logged while the job runs
+        job_id = f"{update.message.chat_id}:{update.message.message_id}"
+        with log_context(job_id=job_id, backend=None, egress=None):
+            process_video(update, status_message, clean_url)
+        return
     
     # If no valid URLs were found
     update.message.reply_text(
@@ -113,9 +80,80 @@ def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Пожалуйста, убедитесь, что вы отправляете ссылку на Instagram Reels, TikTok или YouTube Shorts."
     )
 
+def process_video(update: Update, status_message, clean_url: str) -> None:
+    """Download, post-process and send one video, reporting progress in status_message."""
+    send_path = None
+    try:
+        # Download the video
+        video_info = downloader.download(clean_url)
+        
+        if not video_info or not os.path.exists(video_info.file_path):
+            status_message.edit_text(
+                "❌ Не удалось загрузить видео. Возможно, оно недоступно или приватное."
+            )
+            return
+        
+        # Check file size
+        file_size_bytes = os.path.getsize(video_info.file_path)
+        file_size_mb = file_size_bytes / (1024 * 1024)
+        
+        max_size_bytes = int(settings.max_file_size_mb * 1024 * 1024)
+        
+        # Only announce compression when ffmpeg is available and processing is enabled
+        if file_size_mb > settings.max_file_size_mb and \
+                processor.will_process(file_size_bytes, max_size_bytes, settings.postprocess_mode):
+            status_message.edit_text(
+                f"🗜 Видео слишком большое ({file_size_mb:.1f} MB), сжимаю его..."
+            )
+        
+        # Remux and, if needed, re-encode the video to fit the limit
+        send_path = processor.prepare(
+            video_info.file_path,
+            clean_url,
+            max_size_bytes,
+            settings.postprocess_mode,
+            video_info.duration,
+        )
+        
+        if not send_path:
+            status_message.edit_text(
+                f"❌ Видео слишком большое ({file_size_mb:.1f} MB). "
+                f"Максимальный размер: {settings.max_file_size_mb} MB."
+            )
+            # Clean up the downloaded file
+            downloader.cleanup(video_info.file_path)
+            return
+        
+        # Update status
+        status_message.edit_text("📤 Загружаю видео в Telegram...")
+        
+        # Send the video
+        with open(send_path, 'rb') as video_file:
+            update.message.reply_video(
+                video=video_file,
+                caption=f"📹 {video_info.title or 'Unknown'}",
+                supports_streaming=True,
+            )
+        
+        # Update status message
+        status_message.edit_text("✅ Видео успешно загружено!")
+        
+        # Clean up the downloaded file and the link to the processed copy (the copy stays cached)
+        downloader.cleanup(video_info.file_path)
+        if send_path != video_info.file_path:
+            downloader.cleanup(send_path)
+    
+    except Exception as e:
+        logger.error("Error processing video: {}", e)
+        if send_path and send_path != video_info.file_path:
+            downloader.cleanup(send_path)
+        status_message.edit_text(
+            "❌ Произошла ошибка при обработке видео. Пожалуйста, попробуйте другую ссылку."
+        )
+
 def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log the error and send a message to the user."""
-    logger.error(f"Update {update} caused error {context.error}")
+    logger.error("Update {} caused error {}", update, context.error)
     
     # Send message to the user
     if update and update.effective_message:
@@ -1,28 +1,71 @@
 import os
 import sys
+import logging
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
 from loguru import logger
 
 from config import settings
 from bot.handlers import start_command, help_command, handle_message, error_handler
+from utils.log import ContextFilter, get_log_context, CONTEXT_FIELDS
 
-# Configure logger
-logger.remove()
-logger.add(
-    sys.stderr,
-    format="{time} | {level} | {message}",
-    level="INFO"
-)
-logger.add(
-    "logs/bot.log",
-    rotation="10 MB",
-    retention="1 week",
-    format="{time} | {level} | {message}",
-    level="INFO"
-)
+class InterceptHandler(logging.Handler):
+    """Forward standard logging records (utils.backends, telegram, ...) to loguru."""
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        
+        # Report the caller of the logging call, not this handler
+        frame, depth = logging.currentframe(), 2
+        while frame and frame.f_code.co_filename == logging.__file__:
+            frame = frame.f_back
+            depth += 1
+        
+        fields = {name: getattr(record, name, None) for name in CONTEXT_FIELDS}
+        logger.bind(**{name: value for name, value in fields.items() if value is not None}).opt(
+            depth=depth, exception=record.exc_info
+        ).log(level, record.getMessage())
 
-# Ensure logs directory exists
-os.makedirs("logs", exist_ok=True)
+def _add_log_context(record) -> None:
+    """Attach the job fields set with utils.log.log_context() to loguru records."""
+    for name, value in get_log_context().items():
+        if value is not None:
+            record["extra"].setdefault(name, value)
+
+def configure_logging():
+    """
+    Configure console and file logging.
+    
+    Sinks are enqueued, so records are written by a background thread instead
+    of the handler. Standard logging records are routed into the same sinks.
+    The file sink stores JSON records including the job fields set with
+    utils.log.log_context() (job_id, platform, backend, egress).
+    """
+    # Ensure logs directory exists
+    os.makedirs("logs", exist_ok=True)
+    
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        format="{time} | {level} | {message}",
+        level="INFO",
+        enqueue=True
+    )
+    logger.add(
+        "logs/bot.log",
+        rotation="10 MB",
+        retention="1 week",
+        serialize=True,
+        level="INFO",
+        enqueue=True
+    )
+    logger.configure(patcher=_add_log_context)
+    
+    intercept = InterceptHandler()
+    intercept.addFilter(ContextFilter())
+    logging.basicConfig(handlers=[intercept], level=logging.INFO, force=True)
 
 def setup_application():
     """Set up the application with all handlers."""
@@ -31,6 +74,8 @@ def setup_application():
         logger.error("Bot token not found. Set the BOT_TOKEN environment variable.")
         sys.exit(1)
     
+    settings.ensure_directories()
+    
     # Create application
     application = ApplicationBuilder().token(settings.bot_token).build()
     
@@ -48,6 +93,7 @@ def setup_application():
 
 if __name__ == "__main__":
     # Если запускаем напрямую этот файл
+    configure_logging()
     try:
         app = setup_application()
         logger.info("Starting bot...")
@@ -55,5 +101,8 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Bot stopped by user.")
     except Exception as e:
-        logger.error(f"Bot stopped due to error: {str(e)}")
-        sys.exit(1) 
\ No newline at end of file
+        logger.error("Bot stopped due to error: {}", e)
+        sys.exit(1)
+    finally:
+        # Wait for the enqueued records to be written
+        logger.complete() 
\ No newline at end of file
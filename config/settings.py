@@ -17,6 +17,24 @@ class Settings:
         # Max file size in MB that can be sent via Telegram (50MB limit)
         self.max_file_size_mb = 50
         
+        # Number of concurrent requests (ranges or fragments) per download
+        self.download_workers = int(os.getenv("DOWNLOAD_WORKERS", 4))
+        self.download_chunk_mb = float(os.getenv("DOWNLOAD_CHUNK_MB", 1))
+        self.per_host_connections = int(os.getenv("PER_HOST_CONNECTIONS", 8))
+        self.bandwidth_limit_mbps = float(os.getenv("BANDWIDTH_LIMIT_MBPS", 0))
+        
+        # ffmpeg post-processing: off, oversize (only files above the limit) or always
+        self.postprocess_mode = os.getenv("POSTPROCESS_MODE", "oversize").lower()
+        self.ffmpeg_workers = int(os.getenv("FFMPEG_WORKERS", 2))
+        self.processed_cache_path = os.getenv("PROCESSED_CACHE_PATH", os.path.join("data", "processed"))
+        self.processed_cache_size_mb = float(os.getenv("PROCESSED_CACHE_SIZE_MB", 2048))
+        
+        # Egress pool: comma-separated "direct", proxy URLs or local source addresses,
+        # and minimum seconds between requests to a platform through one egress ("instagram=2,tiktok=1")
+        self.egress_pool = os.getenv("EGRESS_POOL", "")
+        self.egress_pacing = os.getenv("EGRESS_PACING", "instagram=2,tiktok=1")
+        self.egress_cooldown = float(os.getenv("EGRESS_COOLDOWN", 60))
+        
         # Video sources
         self.supported_sources = [
             "instagram.com",
@@ -24,10 +42,11 @@ class Settings:
             "youtube.com",
             "youtu.be"
         ]
+    
+    def ensure_directories(self):
+        """Ensure download and temp directories exist."""
+        os.makedirs(self.download_path, exist_ok=True)
+        os.makedirs(self.temp_path, exist_ok=True)
 
 # Create settings instance
-settings = Settings()
-
-# Ensure download and temp directories exist
-os.makedirs(settings.download_path, exist_ok=True)
-os.makedirs(settings.temp_path, exist_ok=True) 
\ No newline at end of file
+settings = Settings() 
\ No newline at end of file
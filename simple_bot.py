@@ -3,33 +3,24 @@ import os
 import sys
 import time
 import re
-import uuid
-import telepot
-from telepot.loop import MessageLoop
 from dotenv import load_dotenv
-import yt_dlp
 import ssl
 import platform
-import subprocess
 import tempfile
-import requests
 import json
 import logging
+import threading
+from contextlib import nullcontext
 from urllib.parse import urlparse, parse_qs
-import urllib3
 
-# Глобальное отключение проверки SSL для Python
-ssl._create_default_https_context = ssl._create_unverified_context
-
-# Отключаем предупреждения о небезопасных запросах
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)-8s | %(name)s:%(funcName)s:%(lineno)d - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+# Тяжелые библиотеки (telepot, yt_dlp, pytube, requests) и бэкенды скачивания
+# загружаются при первом использовании или в фоне после запуска бота
+from utils.journal import (
+    JobJournal, STAGE_DOWNLOADING, STAGE_PROCESSING, STAGE_UPLOADING, STAGE_DONE, STAGE_FAILED
 )
+from utils.log import setup_logging, stop_logging, log_context
+from utils.url_utils import get_video_key, is_short_link, resolve_short_link
+
 logger = logging.getLogger(__name__)
 
 # Загрузка переменных окружения
@@ -37,9 +28,216 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 TEMP_PATH = os.getenv('TEMP_PATH', 'temp')
 MAX_FILE_SIZE_MB = float(os.getenv('MAX_FILE_SIZE_MB', 50))
+JOURNAL_PATH = os.getenv('JOURNAL_PATH', os.path.join('data', 'journal.sqlite3'))
+# Сколько раз пытаемся довести до конца задачу, прерванную перезапуском
+MAX_JOB_ATTEMPTS = int(os.getenv('MAX_JOB_ATTEMPTS', 2))
+# Задачи старше этого возраста (в секундах) после перезапуска не возобновляем
+MAX_JOB_AGE = float(os.getenv('MAX_JOB_AGE', 3600))
+# Параллельное скачивание: число одновременных запросов на одну загрузку,
+# размер диапазона, лимит соединений на хост и общий лимит скорости (0 - без лимита)
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 4))
+DOWNLOAD_CHUNK_MB = float(os.getenv('DOWNLOAD_CHUNK_MB', 1))
+PER_HOST_CONNECTIONS = int(os.getenv('PER_HOST_CONNECTIONS', 8))
+BANDWIDTH_LIMIT_MBPS = float(os.getenv('BANDWIDTH_LIMIT_MBPS', 0))
+# Постобработка через ffmpeg: off - отключена, oversize - только для слишком больших видео,
+# always - перепаковка всех видео в MP4 с faststart
+POSTPROCESS_MODE = os.getenv('POSTPROCESS_MODE', 'oversize').lower()
+FFMPEG_WORKERS = int(os.getenv('FFMPEG_WORKERS', 2))
+PROCESSED_CACHE_PATH = os.getenv('PROCESSED_CACHE_PATH', os.path.join('data', 'processed'))
+PROCESSED_CACHE_SIZE_MB = float(os.getenv('PROCESSED_CACHE_SIZE_MB', 2048))
+# Логирование: уровень, формат (text или json), необязательный файл
+# и доля сохраняемых DEBUG-сообщений (одно из N для каждого шаблона)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_FILE = os.getenv('LOG_FILE') or None
+LOG_DEBUG_SAMPLE_RATE = int(os.getenv('LOG_DEBUG_SAMPLE_RATE', 100))
+# Предзагрузка популярных видео: видео, запрошенное PREFETCH_THRESHOLD раз за
+# PREFETCH_WINDOW секунд, скачивается в фоне в локальное хранилище, пока нет задач пользователей
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '1').lower() not in ('0', 'false', 'no')
+PREFETCH_WINDOW = float(os.getenv('PREFETCH_WINDOW', 3600))
+PREFETCH_THRESHOLD = int(os.getenv('PREFETCH_THRESHOLD', 3))
+PREFETCH_BANDWIDTH_MBPS = float(os.getenv('PREFETCH_BANDWIDTH_MBPS', 2))
+PREFETCH_STORE_PATH = os.getenv('PREFETCH_STORE_PATH', os.path.join('data', 'prefetch'))
+PREFETCH_STORE_MB = float(os.getenv('PREFETCH_STORE_MB', 1024))
+PREFETCH_METADATA_TTL = float(os.getenv('PREFETCH_METADATA_TTL', 600))
+# Пул выходных адресов: через запятую "direct", URL прокси или локальные IP-адреса.
+# Платформы ограничивают запросы по IP, поэтому задачи переходят на самый здоровый адрес,
+# а запросы к платформе через один адрес идут не чаще чем раз в EGRESS_PACING секунд
+EGRESS_POOL = os.getenv('EGRESS_POOL', '')
+EGRESS_PACING = os.getenv('EGRESS_PACING', 'instagram=2,tiktok=1')
+EGRESS_COOLDOWN = float(os.getenv('EGRESS_COOLDOWN', 60))
+# Порт для метрик в формате Prometheus (/metrics), 0 - не запускать
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Бот создается в main()
+bot = None
+
+# Журнал задач открывается в main()
+journal = JobJournal(JOURNAL_PATH)
+
+# Общие бэкенды создаются при первом использовании
+_backend_lock = threading.Lock()
+_registry = None
+_video_processor = None
+_prefetcher = None
+_egress_pool = None
+_egress_sessions = {}
+
+def configure_logging():
+    """Настройка логирования: записи форматируются и пишутся в фоновом потоке"""
+    if LOG_FILE:
+        os.makedirs(os.path.dirname(LOG_FILE) or '.', exist_ok=True)
+    setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_DEBUG_SAMPLE_RATE)
+
+def configure_ssl():
+    """Глобальное отключение проверки SSL для Python"""
+    ssl._create_default_https_context = ssl._create_unverified_context
+    
+    # Отключаем предупреждения о небезопасных запросах
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# Создаем временную директорию, если она не существует
-os.makedirs(TEMP_PATH, exist_ok=True)
+def get_egress_pool():
+    """Общий пул выходных адресов или None, если он не настроен"""
+    global _egress_pool
+    if not EGRESS_POOL:
+        return None
+    with _backend_lock:
+        if _egress_pool is None:
+            from utils.egress import EgressPool, parse_egress_pool, parse_pacing
+            _egress_pool = EgressPool(
+                parse_egress_pool(EGRESS_POOL),
+                parse_pacing(EGRESS_PACING),
+                cooldown=EGRESS_COOLDOWN
+            )
+    return _egress_pool
+
+def get_registry():
+    """Общий реестр бэкендов скачивания, создается при первом использовании"""
+    global _registry
+    egress_pool = get_egress_pool()
+    with _backend_lock:
+        if _registry is None:
+            from utils.backends import create_registry
+            _registry = create_registry(
+                workers=DOWNLOAD_WORKERS,
+                chunk_size=int(DOWNLOAD_CHUNK_MB * 1024 * 1024),
+                per_host_connections=PER_HOST_CONNECTIONS,
+                bandwidth_limit=BANDWIDTH_LIMIT_MBPS * 1024 * 1024,
+                verify=False,
+                egress_pool=egress_pool
+            )
+    return _registry
+
+def get_video_processor():
+    """Пул ffmpeg для перепаковки и пережатия видео с кэшем результатов"""
+    global _video_processor
+    with _backend_lock:
+        if _video_processor is None:
+            from utils.postprocess import VideoProcessor
+            _video_processor = VideoProcessor(
+                PROCESSED_CACHE_PATH,
+                max_workers=FFMPEG_WORKERS,
+                cache_size_mb=PROCESSED_CACHE_SIZE_MB
+            )
+    return _video_processor
+
+def resolve_video_info(url):
+    """Метаданные видео без скачивания: название, длительность и ожидаемый размер"""
+    from utils.backends import extract_info
+    from utils.egress import is_throttling_error, OUTCOME_THROTTLED
+    
+    # Запрос метаданных тоже идет через самый здоровый выходной адрес
+    egress_pool = get_egress_pool()
+    source_type = determine_source_type(url).lower()
+    egress = egress_pool.choose(source_type, allow_cooling=False) if egress_pool else None
+    if egress_pool and egress is None:
+        return None
+    if egress:
+        egress_pool.pace(egress, source_type)
+    try:
+        info = extract_info(url, verify=False, egress=egress)
+    except Exception as e:
+        if egress and is_throttling_error(e):
+            egress_pool.report(egress, source_type, OUTCOME_THROTTLED)
+        raise
+    if not info:
+        return None
+    return {
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+        'filesize': info.get('filesize') or info.get('filesize_approx'),
+    }
+
+def get_prefetcher():
+    """Фоновая предзагрузка популярных видео или None, если она отключена"""
+    global _prefetcher
+    if not PREFETCH_ENABLED:
+        return None
+    egress_pool = get_egress_pool()
+    with _backend_lock:
+        if _prefetcher is None:
+            from utils.backends import create_registry
+            from utils.prefetch import Prefetcher, MediaStore, TrendTracker
+            # Отдельный реестр со своим лимитом скорости, чтобы предзагрузка
+            # не отнимала канал у задач пользователей
+            registry = create_registry(
+                workers=DOWNLOAD_WORKERS,
+                chunk_size=int(DOWNLOAD_CHUNK_MB * 1024 * 1024),
+                per_host_connections=PER_HOST_CONNECTIONS,
+                bandwidth_limit=PREFETCH_BANDWIDTH_MBPS * 1024 * 1024,
+                verify=False,
+                egress_pool=egress_pool
+            )
+            _prefetcher = Prefetcher(
+                MediaStore(PREFETCH_STORE_PATH, int(PREFETCH_STORE_MB * 1024 * 1024), PREFETCH_METADATA_TTL),
+                TrendTracker(PREFETCH_WINDOW, PREFETCH_THRESHOLD),
+                lambda url, source_type, output_dir: registry.download(
+                    url, source_type, output_dir, names=['parallel', 'yt_dlp']
+                ),
+                resolve_video_info,
+                temp_path=TEMP_PATH
+            ).start()
+    return _prefetcher
+
+def get_egress_session(egress):
+    """Keep-alive сессия requests через выходной адрес, создается при первом использовании"""
+    from utils.parallel_download import SessionPool
+    with _backend_lock:
+        session = _egress_sessions.get(egress.name)
+        if session is None:
+            session = _egress_sessions[egress.name] = SessionPool(
+                verify=False, proxy=egress.proxy, source_address=egress.source_address
+            ).session
+    return session
+
+def resolve_video_key(url, source_type):
+    """Ключ видео; короткие ссылки раскрываются через выходной адрес пула с соблюдением пауз"""
+    if is_short_link(url):
+        egress_pool = get_egress_pool()
+        if egress_pool is None:
+            url = resolve_short_link(url)
+        else:
+            platform_name = source_type.lower()
+            egress = egress_pool.choose(platform_name, allow_cooling=False)
+            # Все адреса заблокированы платформой: видео просто не учитывается
+            if egress is None:
+                return None
+            egress_pool.pace(egress, platform_name)
+            url = resolve_short_link(url, session=get_egress_session(egress))
+    return get_video_key(url)
+
+def user_job():
+    """Контекст задачи пользователя: пока он открыт, предзагрузка ждет"""
+    prefetcher = get_prefetcher()
+    return prefetcher.user_job() if prefetcher else nullcontext()
+
+def prewarm_backends():
+    """Фоновая загрузка библиотек и бэкендов, чтобы первая задача не ждала импорта"""
+    start_time = time.monotonic()
+    get_registry().warm()
+    get_video_processor()
+    logger.info("Бэкенды загружены за %.2f с", time.monotonic() - start_time)
 
 # Функция для извлечения URL из текста
 def extract_urls(text):
@@ -84,194 +282,22 @@ def clean_url(url):
 
 # Функция для скачивания видео
 def download_video(url, source_type=None):
-    """Скачивание видео по URL"""
+    """Скачивание видео по URL через цепочку бэкендов.
+    Возвращает DownloadResult или None"""
     try:
-        # Принудительно отключаем проверку SSL сертификатов
-        old_https_context = ssl._create_default_https_context
-        ssl._create_default_https_context = ssl._create_unverified_context
-        
-        logger.info(f"Определяем тип источника для URL: {url}")
+        logger.info("Определяем тип источника для URL: %s", url)
         
         # Если источник не указан, определяем его
         if not source_type:
             source_type = determine_source_type(url)
         
-        logger.info(f"Тип источника: {source_type}")
-        
-        # Приводим к нижнему регистру для унификации
-        source_type = source_type.lower()
-        
-        # Создаем уникальный ID для скачивания
-        download_id = str(uuid.uuid4())
-        output_file = os.path.join(TEMP_PATH, f"{download_id}.mp4")
-        
-        # Если это YouTube Shorts, используем специальный метод для загрузки
-        if source_type == "youtube" and "shorts" in url:
-            try:
-                logger.info(f"Загрузка YouTube Shorts с помощью специального метода: {url}")
-                result = download_youtube_shorts(url)
-                if result:
-                    return {
-                        "file": result,
-                        "download_id": download_id,
-                        "success": True,
-                        "method": "custom_shorts_downloader"
-                    }
-            except Exception as e:
-                logger.error(f"Ошибка при скачивании YouTube Shorts: {str(e)}")
-        
-        # Для YouTube используем pytube
-        if source_type == "youtube":
-            try:
-                logger.info(f"Загрузка YouTube видео через pytube: {url}")
-                from pytube import YouTube
-                
-                # Отключаем проверку SSL в requests
-                import requests
-                requests.packages.urllib3.disable_warnings()
-                session = requests.Session()
-                session.verify = False
-                
-                # Пробуем скачать видео через pytube
-                yt = YouTube(url)
-                # Получаем самое высокое разрешение
-                stream = yt.streams.get_highest_resolution()
-                
-                if stream:
-                    # Скачиваем видео
-                    stream.download(output_path=TEMP_PATH, filename=f"{download_id}.mp4")
-                    
-                    # Проверяем результат
-                    if os.path.exists(output_file) and os.path.getsize(output_file) > 10000:
-                        return {
-                            "file": output_file,
-                            "download_id": download_id,
-                            "success": True,
-                            "method": "pytube"
-                        }
-            except Exception as e:
-                logger.error(f"Ошибка при скачивании с pytube: {str(e)}")
-        
-        # Если pytube не сработал или это не YouTube, используем yt-dlp через subprocess
-        try:
-            logger.info(f"Попытка скачивания через командную строку для {url}")
-            # Формируем команду для yt-dlp с отключением проверки сертификатов
-            cmd = [
-                'yt-dlp',
-                '--no-check-certificate',  # Отключаем проверку сертификатов
-                '--force-ipv4',            # Принудительно используем IPv4
-                '--geo-bypass',            # Обходим гео-ограничения
-                '--prefer-insecure',       # Предпочитаем небезопасные соединения
-                '--ignore-errors',         # Игнорируем некритические ошибки
-                '--force-generic-extractor', # Используем обобщенный экстрактор при необходимости
-                '-f', 'best[ext=mp4]/best',  # Выбираем лучший формат MP4
-                '-o', output_file,      # Указываем путь для сохранения
-                url                          # URL для скачивания
-            ]
-            
-            # Выполняем команду
-            try:
-                process = subprocess.run(cmd, capture_output=True, text=True, check=True)
-                
-                # Проверяем результат
-                if process.returncode == 0 and os.path.exists(output_file):
-                    file_size = os.path.getsize(output_file) / (1024 * 1024)  # в МБ
-                    logger.info(f"yt-dlp успешно скачал видео, размер: {file_size:.2f} МБ")
-                    
-                    if file_size < 0.1:  # Если файл слишком маленький, это может быть ошибка
-                        logger.warning(f"Скачанный файл слишком маленький ({file_size:.2f} МБ), возможно это превью")
-                        return None
-                    
-                    return {
-                        "file": output_file,
-                        "download_id": download_id,
-                        "success": True,
-                        "source_type": source_type
-                    }
-            except subprocess.CalledProcessError as e:
-                logger.error(f"Ошибка при использовании командной строки yt-dlp: {str(e)}")
-                
-                # В случае ошибки пробуем последнюю попытку с другими параметрами
-                try:
-                    # Пробуем версию с меньшим количеством опций
-                    alternative_cmd = [
-                        'yt-dlp', 
-                        '--no-check-certificate',
-                        '--ignore-errors',
-                        '--no-warnings',
-                        '-f', 'best',
-                        '-o', output_file,
-                        url
-                    ]
-                    
-                    process = subprocess.run(alternative_cmd, capture_output=True, text=True, check=True)
-                    
-                    if process.returncode == 0 and os.path.exists(output_file):
-                        file_size = os.path.getsize(output_file) / (1024 * 1024)  # в МБ
-                        logger.info(f"yt-dlp (простая версия) успешно скачал видео, размер: {file_size:.2f} МБ")
-                        
-                        if file_size < 0.1:
-                            logger.warning(f"Скачанный файл слишком маленький ({file_size:.2f} МБ)")
-                            return None
-                        
-                        return {
-                            "file": output_file,
-                            "download_id": download_id,
-                            "success": True,
-                            "source_type": source_type
-                        }
-                except Exception as e:
-                    logger.error(f"Ошибка при финальной попытке: {str(e)}")
-        
-        except Exception as e:
-            logger.error(f"Ошибка при использовании командной строки: {str(e)}")
+        logger.info("Тип источника: %s", source_type)
         
-        # Восстанавливаем контекст SSL
-        ssl._create_default_https_context = old_https_context
-        
-        # Если все методы не сработали, возвращаем None
-        logger.error(f"Не удалось скачать видео: {url}")
-        return None
-    
-    except Exception as e:
-        logger.error(f"Непредвиденная ошибка при скачивании видео: {str(e)}")
-        return None
-
-# Функция для скачивания YouTube Shorts
-def download_youtube_shorts(url):
-    """Загрузка YouTube видео с помощью последней версии yt-dlp"""
-    logger.info(f"Скачиваем YouTube видео: {url}")
-    
-    # Создаем уникальное имя файла
-    file_name = f"{TEMP_PATH}/{uuid.uuid4()}.mp4"
+        # Бэкенды пробуются по очереди: параллельная загрузка, yt-dlp, pytube, командная строка yt-dlp
+        return get_registry().download(url, source_type, TEMP_PATH)
     
-    try:
-        # Используем упрощенную конфигурацию yt-dlp
-        ydl_opts = {
-            'format': 'best[ext=mp4]/best',  # Лучшее качество mp4
-            'outtmpl': file_name,            # Имя выходного файла
-            'nocheckcertificate': True,      # Отключаем проверку сертификатов
-            'no_warnings': True,
-            'ignoreerrors': False,
-            'verbose': False,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info("Начинаем загрузку с yt-dlp...")
-            info = ydl.extract_info(url, download=True)
-            
-            # Проверяем размер файла
-            if os.path.exists(file_name):
-                file_size = os.path.getsize(file_name) / (1024 * 1024)
-                logger.info(f"Видео скачано: {info.get('title', 'Unknown')}, размер: {file_size:.2f} МБ")
-                
-                if file_size < 0.1:  # Проверка на минимальный размер файла
-                    logger.warning(f"Файл слишком маленький ({file_size:.2f} МБ)")
-                    return None
-                    
-                return file_name
     except Exception as e:
-        logger.error(f"Ошибка при скачивании видео: {e}")
+        logger.error("Непредвиденная ошибка при скачивании видео: %s", e)
         return None
 
 # Функция определения типа источника
@@ -294,7 +320,7 @@ def cleanup_file(file_path):
             os.remove(file_path)
             return True
     except Exception as e:
-        logger.error(f"Ошибка при очистке файла {file_path}: {str(e)}")
+        logger.error("Ошибка при очистке файла %s: %s", file_path, e)
     return False
 
 # Обработчики команд
@@ -318,9 +344,118 @@ def handle_help(chat_id):
         "⚠️ Обрати внимание: я могу скачивать только публичные видео."
     )
 
+def record_request(url, source_type):
+    """Учет запроса видео: популярные ставятся в очередь предзагрузки. Возвращает ключ видео"""
+    prefetcher = get_prefetcher()
+    # Короткие ссылки TikTok раскрываются (успешный результат кэшируется), чтобы ключ был ID видео
+    video_key = resolve_video_key(url, source_type) if prefetcher else None
+    if prefetcher and video_key:
+        prefetcher.record(video_key, url, source_type)
+    return video_key
+
+def process_job(job_id, chat_id, status_msg_id, url, source_type, file_path=None, video_key=None):
+    """Скачивание видео и отправка его пользователю с записью этапов в журнал"""
+    send_path = None
+    try:
+        duration = None
+        prefetcher = get_prefetcher()
+        # Восстановленные задачи приходят без ключа, вычисляем его здесь
+        if prefetcher and video_key is None:
+            video_key = resolve_video_key(url, source_type)
+        
+        # Популярное видео может уже лежать в хранилище предзагрузки, тогда сразу отправляем его
+        if prefetcher and video_key and (not file_path or not os.path.exists(file_path)):
+            file_path = prefetcher.store.checkout(video_key, TEMP_PATH)
+            if file_path:
+                logger.info("Видео %s взято из хранилища предзагрузки", video_key)
+                duration = (prefetcher.store.get_metadata(video_key) or {}).get('duration')
+        
+        # Если файл уже скачан (задача восстановлена после перезапуска), сразу обрабатываем его
+        if not file_path or not os.path.exists(file_path):
+            journal.set_stage(job_id, STAGE_DOWNLOADING)
+            video_data = download_video(url, source_type)
+
+            if not video_data or not os.path.exists(video_data.file_path):
+                bot.editMessageText((chat_id, status_msg_id), 
+                    "❌ Не удалось загрузить видео. Возможно, оно недоступно или приватное."
+                )
+                journal.set_stage(job_id, STAGE_FAILED, error="download failed")
+                return
+
+            file_path = video_data.file_path
+            duration = video_data.duration
+            
+            # Популярное видео сохраняем, чтобы следующие запросы не скачивали его заново
+            if prefetcher and video_key and prefetcher.tracker.is_trending(video_key):
+                prefetcher.store.put(video_key, file_path)
+
+        # Проверяем размер файла
+        file_size_bytes = os.path.getsize(file_path)
+        file_size_mb = file_size_bytes / (1024 * 1024)
+        
+        max_size_bytes = int(MAX_FILE_SIZE_MB * 1024 * 1024)
+        processor = get_video_processor()
+        
+        # Перепаковываем и при необходимости пережимаем видео, если ffmpeg доступен и обработка включена
+        if processor.will_process(file_size_bytes, max_size_bytes, POSTPROCESS_MODE):
+            if file_size_mb > MAX_FILE_SIZE_MB:
+                bot.editMessageText((chat_id, status_msg_id), 
+                    f"🗜 Видео слишком большое ({file_size_mb:.1f} MB), сжимаю его..."
+                )
+            journal.set_stage(job_id, STAGE_PROCESSING, file_path=file_path)
+        send_path = processor.prepare(file_path, url, max_size_bytes, POSTPROCESS_MODE, duration)
+        
+        if not send_path:
+            bot.editMessageText((chat_id, status_msg_id), 
+                f"❌ Видео слишком большое ({file_size_mb:.1f} MB). "
+                f"Максимальный размер: {MAX_FILE_SIZE_MB} MB."
+            )
+            # Удаляем скачанный файл
+            cleanup_file(file_path)
+            journal.set_stage(job_id, STAGE_FAILED, error="file too large")
+            return
+        
+        # Обновляем статус
+        journal.set_stage(job_id, STAGE_UPLOADING, file_path=file_path)
+        bot.editMessageText((chat_id, status_msg_id), "📤 Загружаю видео в Telegram...")
+        
+        # Отправляем видео
+        with open(send_path, 'rb') as video_file:
+            bot.sendVideo(
+                chat_id,
+                video_file,
+                caption=f"📹 Видео из {source_type}",
+                supports_streaming=True
+            )
+        
+        # Обновляем сообщение о статусе
+        bot.editMessageText((chat_id, status_msg_id), "✅ Видео успешно загружено!")
+        journal.set_stage(job_id, STAGE_DONE)
+        
+        # Удаляем скачанный файл и ссылку на обработанную версию (сама она остается в кэше)
+        cleanup_file(file_path)
+        if send_path != file_path:
+            cleanup_file(send_path)
+    
+    except Exception as e:
+        logger.error("Ошибка при обработке видео: %s", e)
+        if send_path and send_path != file_path:
+            cleanup_file(send_path)
+        journal.set_stage(job_id, STAGE_FAILED, error=str(e))
+        bot.editMessageText((chat_id, status_msg_id), 
+            "❌ Произошла ошибка при обработке видео. Пожалуйста, попробуйте другую ссылку."
+        )
+
 def handle_message(msg):
     """Обработка входящих сообщений с URL"""
-    content_type, chat_type, chat_id = telepot.glance(msg)
+    from telepot import glance
+    content_type, chat_type, chat_id = glance(msg)
+    
+    # Telegram может доставить одно и то же обновление повторно, пропускаем уже обработанные
+    update_key = f"{chat_id}:{msg['message_id']}"
+    if journal.is_handled(update_key):
+        logger.info("Сообщение %s уже обработано, пропускаем", update_key)
+        return
     
     # Извлекаем URL из сообщения
     urls = extract_urls(msg['text'])
@@ -343,70 +478,99 @@ def handle_message(msg):
         if not clean_url_result:
             continue
         
+        source_type = determine_source_type(clean_url_result)
+        
+        job_id = journal.create_job(chat_id, clean_url_result, update_key=update_key, source_type=source_type)
+        
         # Уведомляем пользователя о начале загрузки
         status_msg_id = bot.sendMessage(chat_id, 
             "⏳ Начинаю загрузку видео... Это может занять некоторое время."
         )['message_id']
+        journal.set_stage(job_id, STAGE_DOWNLOADING, status_msg_id=status_msg_id)
+        
+        with log_context(job_id=job_id, platform=source_type, backend=None), user_job():
+            # Запрос учитывается уже внутри задачи пользователя: предзагрузка,
+            # которую он может разбудить, ждет ее завершения, а не качает то же видео
+            video_key = record_request(clean_url_result, source_type)
+            process_job(job_id, chat_id, status_msg_id, clean_url_result, source_type, video_key=video_key)
+        return
+    
+    # Если не найдено валидных URL
+    bot.sendMessage(chat_id,
+        "❌ Я не смог распознать ссылку на поддерживаемое видео. "
+        "Пожалуйста, убедитесь, что вы отправляете ссылку на Instagram Reels, TikTok или YouTube Shorts."
+    )
+
+def recover_jobs():
+    """Возобновление задач, прерванных перезапуском бота"""
+    for job in journal.unfinished_jobs():
+        job_id = job['job_id']
+        chat_id = job['chat_id']
+        status_msg_id = job['status_msg_id']
+        attempts = job['attempts'] + 1
         
         try:
-            # Скачиваем видео с использованием улучшенной функции
-            source_type = determine_source_type(clean_url_result)
-            video_data = download_video(clean_url_result, source_type)
+            if status_msg_id is None:
+                status_msg_id = bot.sendMessage(chat_id, 
+                    "⏳ Начинаю загрузку видео... Это может занять некоторое время."
+                )['message_id']
             
-            if not video_data or not os.path.exists(video_data.get("file")):
+            # Слишком старые или многократно прерванные задачи завершаем с сообщением об ошибке
+            if attempts > MAX_JOB_ATTEMPTS or time.time() - job['created_at'] > MAX_JOB_AGE:
+                logger.warning("Задача %s не будет возобновлена (попытка %s)", job_id, attempts)
+                journal.set_stage(job_id, STAGE_FAILED, attempts=attempts, error="interrupted")
                 bot.editMessageText((chat_id, status_msg_id), 
-                    "❌ Не удалось загрузить видео. Возможно, оно недоступно или приватное."
+                    "❌ Загрузка была прервана. Пожалуйста, отправьте ссылку еще раз."
                 )
-                return
-                
-            # Проверяем размер файла
-            file_size_bytes = os.path.getsize(video_data.get("file"))
-            file_size_mb = file_size_bytes / (1024 * 1024)
-            
-            if file_size_mb > MAX_FILE_SIZE_MB:
-                bot.editMessageText((chat_id, status_msg_id), 
-                    f"❌ Видео слишком большое ({file_size_mb:.1f} MB). "
-                    f"Максимальный размер: {MAX_FILE_SIZE_MB} MB."
-                )
-                # Удаляем скачанный файл
-                cleanup_file(video_data.get("file"))
-                return
-            
-            # Обновляем статус
-            bot.editMessageText((chat_id, status_msg_id), "📤 Загружаю видео в Telegram...")
-            
-            # Отправляем видео
-            with open(video_data.get("file"), 'rb') as video_file:
-                bot.sendVideo(
-                    chat_id,
-                    video_file,
-                    caption=f"📹 Видео из {source_type}",
-                    supports_streaming=True
-                )
-            
-            # Обновляем сообщение о статусе
-            bot.editMessageText((chat_id, status_msg_id), "✅ Видео успешно загружено!")
+                if job['file_path']:
+                    cleanup_file(job['file_path'])
+                continue
             
-            # Удаляем скачанный файл
-            cleanup_file(video_data.get("file"))
-            return
-        
+            logger.info("Возобновляем задачу %s с этапа %s: %s", job_id, job['stage'], job['url'])
+            journal.set_stage(job_id, job['stage'], attempts=attempts, status_msg_id=status_msg_id)
+            with log_context(job_id=job_id, platform=job['source_type'], backend=None), user_job():
+                process_job(job_id, chat_id, status_msg_id, job['url'], job['source_type'], job['file_path'])
         except Exception as e:
-            logger.error(f"Ошибка при обработке видео: {str(e)}")
-            bot.editMessageText((chat_id, status_msg_id), 
-                "❌ Произошла ошибка при обработке видео. Пожалуйста, попробуйте другую ссылку."
-            )
-            return
+            logger.error("Ошибка при восстановлении задачи %s: %s", job_id, e)
+            journal.set_stage(job_id, STAGE_FAILED, attempts=attempts, error=str(e))
+
+def create_bot(token):
+    """Создание бота"""
+    import telepot
+    return telepot.Bot(token)
+
+# Виды обновлений с сообщением чата, которые передаются в on_chat_message
+CHAT_UPDATE_FLAVORS = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+
+def run_update_loop(offset=None, timeout=20):
+    """Получение обновлений и их обработка по одному.
     
-    # Если не найдено валидных URL
-    bot.sendMessage(chat_id,
-        "❌ Я не смог распознать ссылку на поддерживаемое видео. "
-        "Пожалуйста, убедитесь, что вы отправляете ссылку на Instagram Reels, TikTok или YouTube Shorts."
-    )
+    Смещение записывается в журнал только после того, как обработчик
+    обновления завершился, поэтому после перезапуска пропускаются только
+    действительно обработанные обновления. Обновление, обработка которого
+    была прервана, придет повторно, а повторная задача отсекается по update_key."""
+    while True:
+        try:
+            updates = bot.getUpdates(offset=offset, timeout=timeout)
+        except Exception as e:
+            logger.error("Ошибка при получении обновлений: %s", e)
+            time.sleep(5)
+            continue
+        
+        for update in updates:
+            msg = next((update[flavor] for flavor in CHAT_UPDATE_FLAVORS if flavor in update), None)
+            if msg is not None:
+                try:
+                    on_chat_message(msg)
+                except Exception as e:
+                    logger.error("Ошибка при обработке обновления %s: %s", update['update_id'], e)
+            journal.record_offset(update['update_id'])
+            offset = update['update_id'] + 1
 
 def on_chat_message(msg):
     """Обработка сообщений пользователя"""
-    content_type, chat_type, chat_id = telepot.glance(msg)
+    from telepot import glance
+    content_type, chat_type, chat_id = glance(msg)
     
     if content_type != 'text':
         bot.sendMessage(chat_id, "Пожалуйста, отправьте мне ссылку на видео.")
@@ -424,15 +588,55 @@ def on_chat_message(msg):
         # Обработка сообщений с URL
         handle_message(msg)
 
-# Инициализация бота
-bot = telepot.Bot(BOT_TOKEN)
-MessageLoop(bot, on_chat_message).run_as_thread()
-
-# Запускаем основную функцию
-if __name__ == "__main__":
+def main():
+    """Запуск бота"""
+    global bot
+    
+    configure_logging()
+    configure_ssl()
+    
+    # Создаем временную директорию, если она не существует
+    os.makedirs(TEMP_PATH, exist_ok=True)
+    
+    # Открываем журнал задач
+    journal.open()
+    last_update_id = journal.last_update_id()
+    
+    # Инициализация бота
+    bot = create_bot(BOT_TOKEN)
+    threading.Thread(
+        target=run_update_loop,
+        args=(last_update_id + 1 if last_update_id is not None else None,),
+        name="updates",
+        daemon=True
+    ).start()
     logger.info("Бот запущен...")
+    
+    # Метрики пула выходных адресов
+    if METRICS_PORT:
+        from utils.metrics import start_metrics_server
+        egress_pool = get_egress_pool()
+        start_metrics_server(METRICS_PORT, *([egress_pool.render_metrics] if egress_pool else []))
+    
+    # Загружаем тяжелые библиотеки в фоне, бот уже принимает обновления
+    threading.Thread(target=prewarm_backends, name="prewarm", daemon=True).start()
+    
+    # Доводим до конца задачи, прерванные предыдущим запуском
+    threading.Thread(target=recover_jobs, name="job-recovery", daemon=True).start()
+    
     try:
         while True:
             time.sleep(10)
     except KeyboardInterrupt:
-        logger.info("Бот остановлен пользователем.") 
\ No newline at end of file
+        logger.info("Бот остановлен пользователем.")
+    finally:
+        if _prefetcher is not None:
+            _prefetcher.stop()
+        if _video_processor is not None:
+            _video_processor.shutdown()
+        journal.close()
+        stop_logging()
+
+# Запускаем основную функцию
+if __name__ == "__main__":
+    main()
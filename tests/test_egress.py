@@ -0,0 +1,125 @@
+import sys
+
+import requests
+
+from utils import egress as egress_module
+from utils.egress import (
+    Egress, EgressPool, ThrottledError, is_throttling_error, OUTCOME_OK, OUTCOME_FAILED, OUTCOME_THROTTLED
+)
+
+
+class DownloadError(Exception):
+    """Stand-in for yt-dlp's DownloadError, which keeps the cause in exc_info."""
+
+    def __init__(self, msg, exc_info=None):
+        super().__init__(msg)
+        self.exc_info = exc_info
+
+
+def http_error(status: int, url: str) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    response.url = url
+    return requests.HTTPError(f"{status} Client Error for url: {url}", response=response)
+
+
+def wrapped(error: BaseException) -> DownloadError:
+    try:
+        raise error
+    except BaseException:
+        return DownloadError("ERROR: unable to download video data", exc_info=sys.exc_info())
+
+
+def test_429_is_throttling():
+    assert is_throttling_error(http_error(429, "https://scontent.cdninstagram.com/v.mp4"))
+    assert is_throttling_error(Exception("ERROR: HTTP Error 429: Too Many Requests"))
+    assert is_throttling_error(ThrottledError("blocked"))
+
+
+def test_403_counts_only_from_platform_hosts():
+    assert is_throttling_error(http_error(403, "https://www.instagram.com/api/v1/media/1/info/"))
+    assert is_throttling_error(http_error(403, "https://www.tiktok.com/@a/video/1"))
+    assert not is_throttling_error(http_error(403, "https://rr3---sn-abc.googlevideo.com/videoplayback"))
+    assert not is_throttling_error(http_error(403, "https://scontent.cdninstagram.com/v.mp4"))
+    # Host lookalikes are not the platform
+    assert not is_throttling_error(http_error(403, "https://notinstagram.com/p/1"))
+
+
+def test_private_post_message_is_not_throttling():
+    message = ("ERROR: [Instagram] abc: Requested content is not available, "
+               "rate-limit reached or login required. Use --cookies")
+    assert not is_throttling_error(DownloadError(message))
+    assert not is_throttling_error(Exception("ERROR: Private video. Sign in if you've been granted access"))
+
+
+def test_wrapped_download_error_is_unwrapped():
+    assert is_throttling_error(wrapped(http_error(429, "https://www.youtube.com/watch?v=abc")))
+    assert not is_throttling_error(wrapped(http_error(404, "https://www.youtube.com/watch?v=abc")))
+
+    try:
+        try:
+            raise http_error(403, "https://www.instagram.com/graphql/query")
+        except requests.HTTPError as e:
+            raise RuntimeError("extraction failed") from e
+    except RuntimeError as e:
+        assert is_throttling_error(e)
+
+
+def test_throttled_egress_is_chosen_last_and_cooldown_doubles(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(egress_module.time, "monotonic", lambda: now[0])
+    first, second = Egress("a"), Egress("b")
+    pool = EgressPool([first, second], cooldown=10, max_cooldown=25)
+
+    assert pool.choose("instagram") is first
+    pool.report(first, "instagram", OUTCOME_THROTTLED)
+    assert pool.choose("instagram") is second
+    # Health is kept per platform
+    assert pool.choose("tiktok") is first
+
+    # Reports of jobs already in flight do not extend the cooldown
+    pool.report(first, "instagram", OUTCOME_THROTTLED)
+    assert pool.snapshot()[0]["cooldown"] == 10
+
+    now[0] += 1
+    pool.report(second, "instagram", OUTCOME_THROTTLED)
+    # Both cooling: the one whose cooldown ends first, and none without allow_cooling
+    assert pool.choose("instagram") is first
+    assert pool.choose("instagram", allow_cooling=False) is None
+    assert pool.choose("instagram", exclude=["a"]) is second
+
+    # A repeated throttling after the cooldown doubles it, up to max_cooldown
+    now[0] += 10
+    pool.report(first, "instagram", OUTCOME_THROTTLED)
+    assert pool.snapshot()[0]["cooldown"] == 20
+    now[0] += 21
+    pool.report(first, "instagram", OUTCOME_THROTTLED)
+    assert pool.snapshot()[0]["cooldown"] == 25
+
+    # A success ends the cooldown and resets the streak
+    pool.report(first, "instagram", OUTCOME_OK)
+    now[0] += 30
+    pool.report(first, "instagram", OUTCOME_THROTTLED)
+    assert pool.snapshot()[0]["cooldown"] == 10
+
+
+def test_failures_lower_health_without_cooldown():
+    first, second = Egress("a"), Egress("b")
+    pool = EgressPool([first, second])
+    pool.report(first, "youtube", OUTCOME_FAILED)
+    assert pool.choose("youtube") is second
+    assert pool.choose("youtube", allow_cooling=False) is second
+    assert pool.snapshot()[0]["cooldown"] == 0
+
+
+def test_egress_names_are_unique():
+    pool = EgressPool([
+        Egress.parse("http://user1:pw@gateway:8080"),
+        Egress.parse("http://user2:pw@gateway:8080"),
+        Egress("gateway:8080#2"),
+        Egress.parse("direct"),
+    ])
+    names = [egress.name for egress in pool.egresses]
+    assert len(set(names)) == len(names)
+    assert names[0] == "gateway:8080"
+    assert all("pw" not in name for name in names)
@@ -0,0 +1,70 @@
+import os
+
+from utils.journal import (
+    JobJournal, STAGE_DOWNLOADING, STAGE_UPLOADING, STAGE_DONE, STAGE_FAILED
+)
+
+
+def reopen(journal: JobJournal) -> JobJournal:
+    journal.close()
+    return JobJournal(journal.path).open()
+
+
+def test_unfinished_jobs_survive_reopen(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite3")).open()
+    job_id = journal.create_job(1, "https://youtu.be/abc", update_key="1:10", source_type="YouTube")
+    journal.set_stage(job_id, STAGE_DOWNLOADING, status_msg_id=42)
+    journal.set_stage(job_id, STAGE_UPLOADING, file_path="temp/abc.mp4")
+
+    journal = reopen(journal)
+    try:
+        jobs = journal.unfinished_jobs()
+        assert len(jobs) == 1
+        job = jobs[0]
+        assert job["job_id"] == job_id
+        assert job["stage"] == STAGE_UPLOADING
+        assert job["status_msg_id"] == 42
+        assert job["file_path"] == "temp/abc.mp4"
+        assert job["source_type"] == "YouTube"
+    finally:
+        journal.close()
+
+
+def test_finished_jobs_are_not_resumed(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite3")).open()
+    done = journal.create_job(1, "https://youtu.be/a", update_key="1:1")
+    failed = journal.create_job(1, "https://youtu.be/b", update_key="1:2")
+    pending = journal.create_job(1, "https://youtu.be/c", update_key="1:3")
+    journal.set_stage(done, STAGE_DONE)
+    journal.set_stage(failed, STAGE_FAILED, error="download failed", attempts=2)
+    assert [job["job_id"] for job in journal.unfinished_jobs()] == [pending]
+
+    journal = reopen(journal)
+    try:
+        assert [job["job_id"] for job in journal.unfinished_jobs()] == [pending]
+    finally:
+        journal.close()
+
+
+def test_handled_updates_and_offset_survive_reopen(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite3")).open()
+    assert journal.last_update_id() is None
+    job_id = journal.create_job(7, "https://www.tiktok.com/@a/video/1", update_key="7:100")
+    journal.set_stage(job_id, STAGE_DONE)
+    journal.record_offset(500)
+    journal.record_offset(499)  # older offsets never move it back
+
+    journal = reopen(journal)
+    try:
+        assert journal.is_handled("7:100")
+        assert not journal.is_handled("7:101")
+        assert journal.last_update_id() == 500
+    finally:
+        journal.close()
+
+
+def test_open_creates_directory(tmp_path):
+    path = tmp_path / "data" / "journal.sqlite3"
+    journal = JobJournal(str(path)).open()
+    journal.close()
+    assert os.path.exists(path)
@@ -0,0 +1,157 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from utils.parallel_download import cookie_header, SessionPool, ParallelDownloader
+
+PAYLOAD = bytes(range(256)) * 40  # 10240 bytes
+
+
+class Server:
+    """Local HTTP server serving PAYLOAD with range support plus fixed documents."""
+
+    def __init__(self, documents=None, ranges=True, short_ranges=False):
+        self.documents = documents or {}
+        self.ranges = ranges
+        self.short_ranges = short_ranges
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}{path}"
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, headers=()) -> None:
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append((self.path, dict(self.headers)))
+                if self.path in server.documents:
+                    self._send(200, server.documents[self.path])
+                    return
+                range_header = self.headers.get("Range")
+                if not range_header or not server.ranges:
+                    self._send(200, PAYLOAD)
+                    return
+                start, end = (int(value) for value in range_header.split("=", 1)[1].split("-"))
+                end = min(end, len(PAYLOAD) - 1)
+                body = PAYLOAD[start:end + 1]
+                if server.short_ranges and start > 0:
+                    body = body[:-1]
+                self._send(206, body, [("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")])
+
+        return Handler
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(**kwargs) -> Server:
+        servers.append(Server(**kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def downloader(chunk_size: int = 4096) -> ParallelDownloader:
+    return ParallelDownloader(SessionPool(), workers=3, chunk_size=chunk_size, timeout=5)
+
+
+def test_cookie_header_skips_attributes():
+    cookies = "tt_chain_token=abc; Domain=.tiktok.com; Path=/; Secure; Expires=1700000000; sid=1; HttpOnly"
+    assert cookie_header(cookies) == "tt_chain_token=abc; sid=1"
+    assert cookie_header("") is None
+    assert cookie_header(None) is None
+    assert cookie_header("Domain=.tiktok.com; Path=/") is None
+
+
+def test_download_splits_into_ranges(serve, tmp_path):
+    server = serve()
+    dest = tmp_path / "video.mp4"
+    assert downloader(chunk_size=4096).download(server.url("/video.mp4"), str(dest)) == len(PAYLOAD)
+    assert dest.read_bytes() == PAYLOAD
+    ranges = sorted(headers["Range"] for _, headers in server.requests)
+    # The probe, then ceil(10240 / 4096) ranges with the last one shorter
+    assert ranges == ["bytes=0-0", "bytes=0-4095", "bytes=4096-8191", "bytes=8192-10239"]
+
+
+def test_download_without_range_support_streams_once(serve, tmp_path):
+    server = serve(ranges=False)
+    dest = tmp_path / "video.mp4"
+    assert downloader().download(server.url("/video.mp4"), str(dest)) == len(PAYLOAD)
+    assert dest.read_bytes() == PAYLOAD
+    assert len(server.requests) == 2
+
+
+def test_short_range_fails_the_download(serve, tmp_path):
+    server = serve(short_ranges=True)
+    with pytest.raises(IOError, match="Incomplete range"):
+        downloader().download(server.url("/video.mp4"), str(tmp_path / "video.mp4"))
+
+
+def test_download_format_sends_cookies(serve, tmp_path):
+    server = serve()
+    info = {
+        "url": server.url("/video.mp4"),
+        "protocol": "https",
+        "http_headers": {"User-Agent": "test", "Cookie": "a=1"},
+        "cookies": "sid=2; Domain=127.0.0.1; Path=/",
+    }
+    dest = tmp_path / "video.mp4"
+    assert downloader().download_format(info, str(dest)) == len(PAYLOAD)
+    assert {headers["Cookie"] for _, headers in server.requests} == {"a=1; sid=2"}
+
+
+def test_plain_hls_playlist_is_joined(serve, tmp_path):
+    playlist = b"#EXTM3U\n#EXT-X-KEY:METHOD=NONE\n#EXTINF:2,\nseg0.ts\n#EXTINF:2,\nseg1.ts\n#EXT-X-ENDLIST\n"
+    server = serve(documents={"/hls/index.m3u8": playlist, "/hls/seg0.ts": b"first", "/hls/seg1.ts": b"second"})
+    dest = tmp_path / "video.ts"
+    info = {"url": server.url("/hls/index.m3u8"), "protocol": "m3u8_native"}
+    assert downloader().download_format(info, str(dest)) == len(b"firstsecond")
+    assert dest.read_bytes() == b"firstsecond"
+
+
+@pytest.mark.parametrize("line", [
+    "#EXT-X-STREAM-INF:BANDWIDTH=1000000",
+    '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"',
+    '#EXT-X-MAP:URI="init.mp4"',
+    "#EXT-X-BYTERANGE:1000@0",
+])
+def test_unsupported_hls_playlists_are_rejected(serve, tmp_path, line):
+    playlist = f"#EXTM3U\n{line}\n#EXTINF:2,\nseg0.ts\n".encode()
+    server = serve(documents={"/hls/index.m3u8": playlist})
+    info = {"url": server.url("/hls/index.m3u8"), "protocol": "m3u8"}
+    assert downloader().download_format(info, str(tmp_path / "video.ts")) is None
+    assert [path for path, _ in server.requests] == ["/hls/index.m3u8"]
+
+
+def test_byte_range_fragments_and_merged_formats_are_rejected(tmp_path):
+    dest = str(tmp_path / "video.mp4")
+    fragments = {"url": "http://127.0.0.1:9/v.mp4", "protocol": "http_dash_segments",
+                 "fragments": [{"url": "http://127.0.0.1:9/v.mp4", "byte_range": {"start": 0, "end": 99}}]}
+    assert downloader().download_format(fragments, dest) is None
+    assert downloader().download_format({"requested_formats": [{}, {}]}, dest) is None
@@ -1,4 +1,22 @@
-from utils.downloader import VideoDownloader
-from utils.url_utils import extract_urls, is_supported_url, get_clean_url
+import importlib
 
-__all__ = ["VideoDownloader", "extract_urls", "is_supported_url", "get_clean_url"] 
\ No newline at end of file
+# Submodules are imported on first attribute access, so importing a light
+# module such as utils.journal does not pull in yt_dlp
+_EXPORTS = {
+    "VideoDownloader": "utils.downloader",
+    "extract_urls": "utils.url_utils",
+    "is_supported_url": "utils.url_utils",
+    "get_clean_url": "utils.url_utils",
+    "get_video_key": "utils.url_utils",
+}
+
+__all__ = ["VideoDownloader", "extract_urls", "is_supported_url", "get_clean_url", "get_video_key"]
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,583 @@
+import os
+import copy
+import shutil
+import threading
+import subprocess
+import time
+import uuid
+import logging
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple
+
+from utils.log import set_log_context
+from utils.egress import (
+    Egress, EgressPool, ThrottledError, is_throttling_error, OUTCOME_OK, OUTCOME_FAILED, OUTCOME_THROTTLED
+)
+
+logger = logging.getLogger(__name__)
+
+# Files smaller than this are most likely a preview instead of the video
+MIN_FILE_SIZE_BYTES = 100 * 1024
+
+# Formats requested from yt-dlp, single-file MP4 whenever possible
+DEFAULT_FORMAT = "best[ext=mp4]/best"
+
+
+@dataclass
+class DownloadResult:
+    """Downloaded video returned by every backend."""
+    file_path: str
+    download_id: str
+    backend: str
+    platform: str
+    title: Optional[str] = None
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @property
+    def file_size(self) -> int:
+        return os.path.getsize(self.file_path)
+
+
+class DownloadBackend:
+    """
+    Base class of download backends.
+
+    Subclasses set `name` and `platforms` (an empty tuple means any platform)
+    and implement `_warm` and `download`. Heavy imports and long-lived state
+    belong in `_warm`, which runs once per backend, either in the background
+    through BackendRegistry.warm() or lazily before the first download.
+    """
+
+    name = ""
+    platforms: tuple = ()
+    # Whether the backend downloads from the yt-dlp info another backend
+    # already extracted in the same job, instead of extracting it again
+    reuses_info = False
+
+    def __init__(self):
+        self._warm_lock = threading.Lock()
+        self.is_warm = False
+
+    def supports(self, platform: str, url: str) -> bool:
+        return not self.platforms or platform in self.platforms
+
+    def supports_egress(self, egress: Optional[Egress]) -> bool:
+        """Whether this backend can download through egress. Unsupported egresses are skipped without a verdict."""
+        return True
+
+    def warm(self) -> None:
+        """Load the backend's dependencies and create its shared state."""
+        with self._warm_lock:
+            if not self.is_warm:
+                self._warm()
+                self.is_warm = True
+
+    def _warm(self) -> None:
+        pass
+
+    def download(self, url: str, platform: str, output_dir: str, download_id: str,
+                 egress: Optional[Egress] = None) -> Optional[DownloadResult]:
+        """
+        Download a video.
+
+        Args:
+            url: Cleaned video URL
+            platform: Lowercase platform name (youtube, instagram, tiktok, ...)
+            output_dir: Directory for the downloaded file
+            download_id: Unique id used for the file name
+            egress: Proxy or source address to download through, None for the default route
+
+        Returns:
+            Download result, or None if this backend could not get the video
+
+        Raises:
+            ThrottledError: (or any exception recognized by is_throttling_error)
+                when the platform throttles the egress
+        """
+        raise NotImplementedError
+
+
+class _JobInfoCache:
+    """
+    yt-dlp info extracted during a job, kept until the job ends.
+
+    Keyed by download id and egress: media URLs can be bound to the IP that
+    extracted them, so a job that moved to another egress extracts again.
+    """
+
+    def __init__(self):
+        self._infos: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, download_id: str, egress: Optional[Egress]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._infos.get((download_id, egress.name if egress else None))
+
+    def put(self, download_id: str, egress: Optional[Egress], info: Dict[str, Any]) -> None:
+        with self._lock:
+            self._infos[(download_id, egress.name if egress else None)] = info
+
+    def discard(self, download_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._infos if key[0] == download_id]:
+                del self._infos[key]
+
+
+_job_infos = _JobInfoCache()
+
+
+def extract_info(url: str, verify: bool = True, egress: Optional[Egress] = None) -> Optional[Dict[str, Any]]:
+    """Resolve a URL with yt-dlp without downloading, returning the info of the selected format."""
+    import yt_dlp
+    options = {
+        "format": DEFAULT_FORMAT,
+        "nocheckcertificate": not verify,
+        "quiet": True,
+        "no_warnings": True,
+    }
+    if egress:
+        options.update(egress.ytdlp_options())
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if info and "entries" in info:
+        info = info["entries"][0]
+    return info or None
+
+
+def _info_fields(info: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "width": info.get("width"),
+        "height": info.get("height"),
+    }
+
+
+class ParallelHttpBackend(DownloadBackend):
+    """yt-dlp resolves the format, the parallel engine downloads it through the shared session pool."""
+
+    name = "parallel"
+    reuses_info = True
+
+    def __init__(self, workers: int = 4, chunk_size: int = 1024 * 1024, per_host_connections: int = 8,
+                 bandwidth_limit: float = 0, verify: bool = True, ffmpeg: str = "ffmpeg"):
+        super().__init__()
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.per_host_connections = per_host_connections
+        self.bandwidth_limit = bandwidth_limit
+        self.verify = verify
+        self.ffmpeg_executable = ffmpeg
+        self.ffmpeg = None
+        self.downloader = None
+        self._limiter = None
+        self._egress_downloaders: Dict[str, Any] = {}
+        self._egress_lock = threading.Lock()
+
+    def _warm(self) -> None:
+        import yt_dlp  # noqa: F401
+        from utils.parallel_download import BandwidthLimiter
+        self._limiter = BandwidthLimiter(self.bandwidth_limit)
+        self.downloader = self._create_downloader(None)
+        self.ffmpeg = shutil.which(self.ffmpeg_executable)
+
+    def _create_downloader(self, egress: Optional[Egress]):
+        from utils.parallel_download import SessionPool, ParallelDownloader
+        pool = SessionPool(
+            per_host_connections=self.per_host_connections,
+            verify=self.verify,
+            proxy=egress.proxy if egress else None,
+            source_address=egress.source_address if egress else None,
+        )
+        # The bandwidth budget is shared by every egress
+        return ParallelDownloader(pool, self._limiter, workers=self.workers, chunk_size=self.chunk_size)
+
+    def downloader_for(self, egress: Optional[Egress]):
+        """Downloader whose session pool goes through egress, created on first use."""
+        if egress is None or (egress.proxy is None and egress.source_address is None):
+            return self.downloader
+        with self._egress_lock:
+            downloader = self._egress_downloaders.get(egress.name)
+            if downloader is None:
+                downloader = self._egress_downloaders[egress.name] = self._create_downloader(egress)
+        return downloader
+
+    def download(self, url, platform, output_dir, download_id, egress=None):
+        from utils.parallel_download import HLS_PROTOCOLS
+        info = _job_infos.get(download_id, egress)
+        if info is None:
+            info = extract_info(url, self.verify, egress)
+            if not info:
+                return None
+            # The next backend downloads from the same info if this one cannot
+            _job_infos.put(download_id, egress, info)
+
+        # Joined HLS segments are MPEG-TS even when yt-dlp reports mp4, they
+        # need the remux yt-dlp would have done. Without ffmpeg yt-dlp takes over
+        hls = info.get("protocol") in HLS_PROTOCOLS
+        if hls and not self.ffmpeg:
+            logger.info("ffmpeg not found, leaving the HLS format to the next backend")
+            return None
+
+        output_file = os.path.join(output_dir, f"{download_id}.{'mp4' if hls else info.get('ext') or 'mp4'}")
+        download_file = os.path.join(output_dir, f"{download_id}.ts") if hls else output_file
+        if self.downloader_for(egress).download_format(info, download_file) is None:
+            logger.info("Format protocol %s is not supported by the parallel engine", info.get("protocol"))
+            return None
+        if hls:
+            remuxed = self._remux_ts(download_file, output_file)
+            os.remove(download_file)
+            if not remuxed:
+                return None
+        return DownloadResult(output_file, download_id, self.name, platform, **_info_fields(info))
+
+    def _remux_ts(self, source: str, output_file: str) -> bool:
+        """Repackage an MPEG-TS stream into MP4 without re-encoding."""
+        cmd = [self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error", "-i", source,
+               "-c", "copy", "-bsf:a", "aac_adtstoasc", "-f", "mp4", output_file]
+        process = subprocess.run(cmd, capture_output=True, text=True)
+        if process.returncode != 0:
+            logger.error("ffmpeg failed to remux %s: %s", source, process.stderr.strip()[-500:])
+            return False
+        return True
+
+
+class YtDlpBackend(DownloadBackend):
+    """yt-dlp used as a library, with platform-specific options."""
+
+    name = "yt_dlp"
+    reuses_info = True
+
+    def __init__(self, workers: int = 4, verify: bool = True, bandwidth_limit: float = 0):
+        super().__init__()
+        self.workers = workers
+        self.verify = verify
+        self.bandwidth_limit = bandwidth_limit
+
+    def _warm(self) -> None:
+        import yt_dlp  # noqa: F401
+
+    def _options(self, platform: str, output_template: str, egress: Optional[Egress] = None) -> Dict[str, Any]:
+        options = {
+            "format": DEFAULT_FORMAT,
+            "outtmpl": output_template,
+            "nocheckcertificate": not self.verify,
+            "quiet": True,
+            "no_warnings": True,
+            "ignoreerrors": False,
+            "concurrent_fragment_downloads": self.workers,
+        }
+        if self.bandwidth_limit:
+            options["ratelimit"] = int(self.bandwidth_limit)
+        if egress:
+            options.update(egress.ytdlp_options())
+        if platform in ("instagram", "tiktok"):
+            options.update({
+                "cookiesfrombrowser": None,  # No cookies needed
+                "extractor_args": {platform: {"skip_download": False}},
+            })
+        return options
+
+    def download(self, url, platform, output_dir, download_id, egress=None):
+        import yt_dlp
+        options = self._options(platform, os.path.join(output_dir, f"{download_id}.%(ext)s"), egress)
+        extracted = _job_infos.get(download_id, egress)
+        with yt_dlp.YoutubeDL(options) as ydl:
+            if extracted:
+                # yt-dlp modifies the info while downloading, the cached one stays intact
+                info = ydl.process_ie_result(copy.deepcopy(extracted), download=True)
+            else:
+                info = ydl.extract_info(url, download=True)
+        if not info:
+            return None
+        if "entries" in info:
+            # Playlist/multiple entries, we take the first
+            info = info["entries"][0]
+
+        output_file = _find_output(output_dir, download_id, info.get("ext"))
+        if not output_file:
+            return None
+        return DownloadResult(output_file, download_id, self.name, platform, **_info_fields(info))
+
+
+class PytubeBackend(DownloadBackend):
+    """pytube, YouTube only."""
+
+    name = "pytube"
+    platforms = ("youtube",)
+
+    def _warm(self) -> None:
+        import pytube  # noqa: F401
+
+    def supports_egress(self, egress):
+        # pytube installs its proxy as the process-wide urllib opener, so jobs on
+        # different egresses would overwrite each other's route. It cannot bind
+        # connections to a local address either, only the default route is safe
+        return egress is None or (egress.proxy is None and egress.source_address is None)
+
+    def download(self, url, platform, output_dir, download_id, egress=None):
+        from pytube import YouTube
+        yt = YouTube(url)
+        stream = yt.streams.get_highest_resolution()
+        if not stream:
+            return None
+
+        output_file = stream.download(output_path=output_dir, filename=f"{download_id}.mp4")
+        return DownloadResult(output_file, download_id, self.name, platform, title=yt.title, duration=yt.length)
+
+
+class YtDlpCliBackend(DownloadBackend):
+    """yt-dlp command line, retried once with a minimal set of options."""
+
+    name = "yt_dlp_cli"
+
+    def __init__(self, workers: int = 4, verify: bool = True, bandwidth_limit: float = 0,
+                 executable: str = "yt-dlp"):
+        super().__init__()
+        self.workers = workers
+        self.verify = verify
+        self.bandwidth_limit = bandwidth_limit
+        self.executable = executable
+        self.path = None
+
+    def _warm(self) -> None:
+        self.path = shutil.which(self.executable)
+
+    def _commands(self, url: str, output_file: str, egress: Optional[Egress] = None) -> List[List[str]]:
+        insecure = [] if self.verify else ["--no-check-certificate"]
+        if self.bandwidth_limit:
+            insecure += ["--limit-rate", str(int(self.bandwidth_limit))]
+        if egress:
+            insecure += egress.cli_args()
+        return [
+            [
+                self.path, *insecure,
+                "--force-ipv4",
+                "--geo-bypass",
+                "--prefer-insecure",
+                "--ignore-errors",
+                "--force-generic-extractor",
+                "-N", str(self.workers),
+                "-f", DEFAULT_FORMAT,
+                "-o", output_file,
+                url,
+            ],
+            # Fallback with fewer options
+            [
+                self.path, *insecure,
+                "--ignore-errors",
+                "--no-warnings",
+                "-N", str(self.workers),
+                "-f", "best",
+                "-o", output_file,
+                url,
+            ],
+        ]
+
+    def download(self, url, platform, output_dir, download_id, egress=None):
+        if not self.path:
+            logger.warning("%s executable not found", self.executable)
+            return None
+
+        output_file = os.path.join(output_dir, f"{download_id}.mp4")
+        for cmd in self._commands(url, output_file, egress):
+            process = subprocess.run(cmd, capture_output=True, text=True)
+            if process.returncode == 0 and os.path.exists(output_file):
+                return DownloadResult(output_file, download_id, self.name, platform)
+            stderr = process.stderr.strip()[-300:]
+            logger.error("yt-dlp exited with %d: %s", process.returncode, stderr)
+            _remove_outputs(output_dir, download_id)
+            # The fallback command would be throttled just the same
+            if is_throttling_error(Exception(stderr)):
+                raise ThrottledError(stderr)
+        return None
+
+
+def _find_output(output_dir: str, download_id: str, ext: Optional[str]) -> Optional[str]:
+    """Find the file a backend saved for download_id."""
+    for candidate_ext in (ext, "mp4", "webm", "mkv"):
+        if candidate_ext:
+            path = os.path.join(output_dir, f"{download_id}.{candidate_ext}")
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def _remove_outputs(output_dir: str, download_id: str) -> None:
+    """Remove everything a failed attempt left behind for download_id."""
+    try:
+        names = os.listdir(output_dir)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(download_id):
+            try:
+                os.remove(os.path.join(output_dir, name))
+            except OSError as e:
+                logger.error("Error cleaning up file %s: %s", name, e)
+
+
+class BackendRegistry:
+    """
+    Ordered set of download backends tried in turn until one succeeds.
+
+    With an egress pool, every job runs through the healthiest egress for
+    its platform. When the platform throttles that egress the job moves to
+    the next healthiest one and resumes with the backend that was throttled,
+    instead of running the rest of the chain into the same block.
+    """
+
+    def __init__(self, egress_pool: Optional[EgressPool] = None):
+        self._backends: List[DownloadBackend] = []
+        self.egress_pool = egress_pool
+
+    def register(self, backend: DownloadBackend) -> DownloadBackend:
+        """Add a backend at the end of the fallback chain, replacing one with the same name."""
+        self._backends = [b for b in self._backends if b.name != backend.name]
+        self._backends.append(backend)
+        return backend
+
+    def get(self, name: str) -> Optional[DownloadBackend]:
+        return next((backend for backend in self._backends if backend.name == name), None)
+
+    def names(self) -> List[str]:
+        return [backend.name for backend in self._backends]
+
+    def for_platform(self, platform: str, url: str) -> List[DownloadBackend]:
+        return [backend for backend in self._backends if backend.supports(platform, url)]
+
+    def warm(self) -> None:
+        """Warm every backend, logging the time each one takes."""
+        for backend in self._backends:
+            start = time.monotonic()
+            try:
+                backend.warm()
+                logger.info("Backend %s warmed in %.2f s", backend.name, time.monotonic() - start)
+            except Exception as e:
+                logger.warning("Backend %s failed to warm: %s", backend.name, e)
+
+    def download(self, url: str, platform: str, output_dir: str,
+                 names: Optional[List[str]] = None) -> Optional[DownloadResult]:
+        """
+        Try the backends supporting the platform in order.
+
+        Args:
+            url: Cleaned video URL
+            platform: Platform name, compared case-insensitively
+            output_dir: Directory for the downloaded file
+            names: Restrict the chain to these backends
+
+        Returns:
+            Result of the first backend that produced a plausible file, or None
+        """
+        platform = platform.lower()
+        download_id = str(uuid.uuid4())
+        os.makedirs(output_dir, exist_ok=True)
+        backends = [backend for backend in self.for_platform(platform, url)
+                    if names is None or backend.name in names]
+        try:
+            return self._download(backends, url, platform, output_dir, download_id)
+        finally:
+            _job_infos.discard(download_id)
+
+    def _download(self, backends: List[DownloadBackend], url: str, platform: str, output_dir: str,
+                  download_id: str) -> Optional[DownloadResult]:
+        if self.egress_pool is None:
+            result, _ = self._try_backends(backends, url, platform, output_dir, download_id, None)
+            if result is None:
+                logger.error("All backends failed for %s", url)
+            return result
+
+        tried: List[str] = []
+        while backends:
+            # Only the first egress may be one cooling down, if all of them are
+            egress = self.egress_pool.choose(platform, exclude=tried, allow_cooling=not tried)
+            if egress is None:
+                logger.error("Every egress is throttled by %s, giving up on %s", platform, url)
+                return None
+            tried.append(egress.name)
+            set_log_context(egress=egress.name)
+            with self.egress_pool.lease(egress):
+                result, backends = self._try_backends(backends, url, platform, output_dir, download_id, egress)
+            if result is not None:
+                return result
+
+        logger.error("All backends failed for %s", url)
+        return None
+
+    def _try_backends(self, backends: List[DownloadBackend], url: str, platform: str, output_dir: str,
+                      download_id: str, egress: Optional[Egress]
+                      ) -> Tuple[Optional[DownloadResult], List[DownloadBackend]]:
+        """
+        Run the chain through one egress.
+
+        Returns:
+            The result, and the backends still to try if the egress was throttled
+        """
+        for index, backend in enumerate(backends):
+            if not backend.supports_egress(egress):
+                logger.debug("Backend %s does not support egress %s, skipping", backend.name, egress.name)
+                continue
+            set_log_context(backend=backend.name)
+            start = time.monotonic()
+            try:
+                backend.warm()
+                # A backend reusing the job's extracted info sends no new request to the platform
+                reused = backend.reuses_info and _job_infos.get(download_id, egress) is not None
+                if egress is not None and not reused:
+                    self.egress_pool.pace(egress, platform)
+                result = backend.download(url, platform, output_dir, download_id, egress)
+            except Exception as e:
+                if egress is not None and is_throttling_error(e):
+                    _remove_outputs(output_dir, download_id)
+                    self.egress_pool.report(egress, platform, OUTCOME_THROTTLED)
+                    logger.warning("Backend %s throttled through %s for %s: %s", backend.name, egress.name, url, e)
+                    return None, backends[index:]
+                logger.error("Backend %s failed for %s: %s", backend.name, url, e)
+                result = None
+
+            if result and os.path.exists(result.file_path):
+                if result.file_size >= MIN_FILE_SIZE_BYTES:
+                    logger.info(
+                        "Backend %s downloaded %s: %.2f MB in %.1f s",
+                        backend.name, url, result.file_size / (1024 * 1024), time.monotonic() - start
+                    )
+                    if egress is not None:
+                        self.egress_pool.report(egress, platform, OUTCOME_OK)
+                    return result, []
+                logger.warning(
+                    "Backend %s returned a file of %d bytes, probably a preview",
+                    backend.name, result.file_size
+                )
+
+            if egress is not None:
+                self.egress_pool.report(egress, platform, OUTCOME_FAILED)
+            # Leave nothing behind that could confuse the next backend
+            _remove_outputs(output_dir, download_id)
+
+        return None, []
+
+
+def create_registry(workers: int = 4, chunk_size: int = 1024 * 1024, per_host_connections: int = 8,
+                    bandwidth_limit: float = 0, verify: bool = True,
+                    egress_pool: Optional[EgressPool] = None) -> BackendRegistry:
+    """
+    Build the default fallback chain: parallel engine, yt-dlp, pytube, yt-dlp CLI.
+
+    Args:
+        workers: Concurrent requests (ranges or fragments) per download
+        chunk_size: Byte-range size of the parallel engine
+        per_host_connections: Connection cap per host of the shared session pool
+        bandwidth_limit: Bandwidth budget in bytes per second, 0 for none. It is shared
+            by all downloads of the parallel engine and applied per download by yt-dlp
+        verify: Whether to verify TLS certificates
+        egress_pool: Pool of proxies or source addresses to spread downloads over, None for the default route
+    """
+    registry = BackendRegistry(egress_pool)
+    registry.register(ParallelHttpBackend(workers, chunk_size, per_host_connections, bandwidth_limit, verify))
+    registry.register(YtDlpBackend(workers, verify, bandwidth_limit))
+    registry.register(PytubeBackend())
+    registry.register(YtDlpCliBackend(workers, verify, bandwidth_limit))
+    return registry
@@ -0,0 +1,339 @@
+import re
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_OK = "ok"
+OUTCOME_FAILED = "failed"
+OUTCOME_THROTTLED = "throttled"
+
+# Value an outcome pulls the health score towards. Ordinary failures are
+# often specific to the video (private, removed), so they count only partly
+_OUTCOME_SCORES = {OUTCOME_OK: 1.0, OUTCOME_FAILED: 0.5, OUTCOME_THROTTLED: 0.0}
+
+# Status that always means throttling
+THROTTLE_STATUS = 429
+
+# 403 means throttling only when the platform itself answers it; a 403 from a
+# CDN is usually an expired or cookie-bound media URL
+PLATFORM_HOSTS = ("instagram.com", "tiktok.com", "youtube.com", "youtu.be")
+
+# Explicit rate-limit wording. yt-dlp's Instagram message "rate-limit reached
+# or login required" is deliberately not matched: it is also printed for
+# private posts, which must not cool down the egress
+_THROTTLE_RE = re.compile(
+    r"HTTP Error 429|\b429 Client Error|too many requests|rate[- ]limit(?:ed| exceeded)|"
+    r"please wait a few minutes|temporarily blocked",
+    re.IGNORECASE,
+)
+
+
+class ThrottledError(Exception):
+    """Raised by a backend when the platform answers with a throttling response."""
+
+
+def _http_status(error: BaseException) -> Tuple[Optional[int], Optional[str]]:
+    """Status code and URL of an HTTP error from requests, urllib or yt-dlp."""
+    response = getattr(error, "response", None)
+    status = (getattr(response, "status_code", None) or getattr(response, "status", None)
+              or getattr(error, "code", None) or getattr(error, "status", None))
+    url = getattr(response, "url", None) or getattr(error, "url", None)
+    return (status if isinstance(status, int) else None), url
+
+
+def _is_platform_host(url: Optional[str]) -> bool:
+    host = (urlparse(url).hostname or "") if url else ""
+    return any(host == domain or host.endswith("." + domain) for domain in PLATFORM_HOSTS)
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """
+    Whether an exception raised while downloading looks like per-IP throttling.
+
+    Recognizes ThrottledError, HTTP 429, HTTP 403 answered by a platform host
+    (not a CDN) and explicit rate-limit messages. yt-dlp errors are unwrapped
+    to the HTTP error that caused them. Anything else is an ordinary failure.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, ThrottledError):
+            return True
+        status, url = _http_status(error)
+        if status == THROTTLE_STATUS or (status == 403 and _is_platform_host(url)):
+            return True
+        if _THROTTLE_RE.search(str(error)):
+            return True
+        # yt-dlp's DownloadError keeps the original exception in exc_info
+        exc_info = getattr(error, "exc_info", None)
+        cause = exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None
+        error = cause or error.__cause__ or error.__context__
+    return False
+
+
+class Egress:
+    """A way out to the internet: the default route, a proxy or a local source address."""
+
+    def __init__(self, name: str, proxy: Optional[str] = None, source_address: Optional[str] = None):
+        """
+        Args:
+            name: Name used in logs and metrics
+            proxy: Proxy URL (http, https or socks5), None to connect directly
+            source_address: Local IP address outgoing connections are bound to
+        """
+        self.name = name
+        self.proxy = proxy
+        self.source_address = source_address
+
+    @classmethod
+    def parse(cls, spec: str) -> "Egress":
+        """
+        Build an egress from its configuration form.
+
+        "direct" is the default route, anything with "://" is a proxy URL and
+        anything else is a local source address.
+        """
+        spec = spec.strip()
+        if spec == "direct":
+            return cls("direct")
+        if "://" in spec:
+            parsed = urlparse(spec)
+            # Credentials must not end up in logs and metrics
+            return cls(f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname or spec, proxy=spec)
+        return cls(spec, source_address=spec)
+
+    @property
+    def requests_proxies(self) -> Dict[str, str]:
+        return {"http": self.proxy, "https": self.proxy} if self.proxy else {}
+
+    def ytdlp_options(self) -> Dict[str, Any]:
+        """Options routing yt-dlp through this egress."""
+        options = {}
+        if self.proxy:
+            options["proxy"] = self.proxy
+        if self.source_address:
+            options["source_address"] = self.source_address
+        return options
+
+    def cli_args(self) -> List[str]:
+        """yt-dlp command-line arguments routing it through this egress."""
+        args = []
+        if self.proxy:
+            args += ["--proxy", self.proxy]
+        if self.source_address:
+            args += ["--source-address", self.source_address]
+        return args
+
+    def __repr__(self) -> str:
+        return f"Egress({self.name!r})"
+
+
+class _Health:
+    """Health of one egress towards one platform."""
+
+    def __init__(self):
+        self.score = 1.0
+        self.throttle_streak = 0
+        self.cooldown_until = 0.0
+        self.next_request = 0.0
+        self.outcomes: Dict[str, int] = {outcome: 0 for outcome in _OUTCOME_SCORES}
+
+
+class EgressPool:
+    """
+    Pool of egresses tracking their health per platform.
+
+    Platforms throttle per source IP, so health is kept per egress and
+    platform as an exponentially weighted moving average of download
+    outcomes. A throttled egress is additionally put on a cooldown for that
+    platform that doubles with every consecutive throttling response.
+    Requests to a platform through one egress are paced to a minimum
+    interval.
+    """
+
+    def __init__(self, egresses: Iterable[Egress], pacing: Optional[Dict[str, float]] = None,
+                 alpha: float = 0.3, cooldown: float = 60, max_cooldown: float = 1800):
+        """
+        Args:
+            egresses: Egresses of the pool, the first one is preferred while all are equally healthy
+            pacing: Minimum seconds between requests to a platform through one egress
+            alpha: Weight of the latest outcome in the health score
+            cooldown: Seconds a throttled egress is avoided for the platform, doubled on every repeat
+            max_cooldown: Upper bound of the cooldown
+        """
+        self.egresses = list(egresses) or [Egress("direct")]
+        # Health, load and the tried set of a job are keyed by name, so names
+        # must be unique, e.g. for one proxy gateway with different credentials
+        names = set()
+        for egress in self.egresses:
+            name, suffix = egress.name, 2
+            while egress.name in names:
+                egress.name = f"{name}#{suffix}"
+                suffix += 1
+            names.add(egress.name)
+        self.pacing = {platform.lower(): interval for platform, interval in (pacing or {}).items()}
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self._health: Dict[Tuple[str, str], _Health] = {}
+        self._in_flight: Dict[str, int] = {egress.name: 0 for egress in self.egresses}
+        self._lock = threading.Lock()
+
+    def _get_health(self, egress: Egress, platform: str) -> _Health:
+        key = (egress.name, platform)
+        health = self._health.get(key)
+        if health is None:
+            health = self._health[key] = _Health()
+        return health
+
+    def choose(self, platform: str, exclude: Iterable[str] = (), allow_cooling: bool = True) -> Optional[Egress]:
+        """
+        Pick the healthiest egress for a platform.
+
+        Egresses cooling down after throttling are only used when every
+        other one is excluded or cooling too, and only if allow_cooling is set.
+
+        Args:
+            platform: Lowercase platform name
+            exclude: Names of egresses already tried for this job
+            allow_cooling: Whether an egress on cooldown may be returned
+
+        Returns:
+            The chosen egress, or None if there is none left
+        """
+        exclude = set(exclude)
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for index, egress in enumerate(self.egresses):
+                if egress.name in exclude:
+                    continue
+                health = self._get_health(egress, platform)
+                cooling = health.cooldown_until > now
+                if cooling and not allow_cooling:
+                    continue
+                sort_key = (cooling, health.cooldown_until if cooling else 0,
+                            -health.score, self._in_flight[egress.name], index)
+                candidates.append((sort_key, egress))
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: candidate[0])[1]
+
+    @contextmanager
+    def lease(self, egress: Egress) -> Iterator[Egress]:
+        """Count a job as running through egress, spreading load across equally healthy ones."""
+        with self._lock:
+            self._in_flight[egress.name] += 1
+        try:
+            yield egress
+        finally:
+            with self._lock:
+                self._in_flight[egress.name] -= 1
+
+    def pace(self, egress: Egress, platform: str) -> None:
+        """Block until a request to the platform through egress is allowed."""
+        interval = self.pacing.get(platform, 0)
+        if interval <= 0:
+            return
+        with self._lock:
+            health = self._get_health(egress, platform)
+            now = time.monotonic()
+            start = max(now, health.next_request)
+            health.next_request = start + interval
+        if start > now:
+            logger.debug("Pacing %s through %s for %.2f s", platform, egress.name, start - now)
+            time.sleep(start - now)
+
+    def report(self, egress: Egress, platform: str, outcome: str) -> None:
+        """Record the outcome of a download attempt through egress."""
+        with self._lock:
+            health = self._get_health(egress, platform)
+            health.outcomes[outcome] += 1
+            health.score += self.alpha * (_OUTCOME_SCORES[outcome] - health.score)
+            now = time.monotonic()
+            if outcome == OUTCOME_THROTTLED:
+                if health.cooldown_until > now:
+                    # Jobs that were already in flight report the same throttling again
+                    cooldown = health.cooldown_until - now
+                else:
+                    cooldown = min(self.cooldown * 2 ** health.throttle_streak, self.max_cooldown)
+                    health.throttle_streak += 1
+                    health.cooldown_until = now + cooldown
+            elif outcome == OUTCOME_OK:
+                health.throttle_streak = 0
+                health.cooldown_until = 0.0
+            score = health.score
+        if outcome == OUTCOME_THROTTLED:
+            logger.warning("Egress %s throttled by %s, cooling down for %.0f s (health %.2f)",
+                           egress.name, platform, cooldown, score)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Current health of every egress and platform seen so far."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "egress": name,
+                    "platform": platform,
+                    "score": health.score,
+                    "cooldown": max(0.0, health.cooldown_until - now),
+                    "in_flight": self._in_flight.get(name, 0),
+                    "outcomes": dict(health.outcomes),
+                }
+                for (name, platform), health in sorted(self._health.items())
+            ]
+
+    def render_metrics(self) -> str:
+        """Health of the pool in the Prometheus text exposition format."""
+        lines = [
+            "# HELP egress_health_score EWMA of download outcomes per egress and platform (1 = healthy).",
+            "# TYPE egress_health_score gauge",
+        ]
+        snapshot = self.snapshot()
+        for entry in snapshot:
+            lines.append(f'egress_health_score{{egress="{entry["egress"]}",platform="{entry["platform"]}"}} '
+                         f'{entry["score"]:.4f}')
+        lines += [
+            "# HELP egress_cooldown_seconds Remaining time an egress is avoided for a platform after throttling.",
+            "# TYPE egress_cooldown_seconds gauge",
+        ]
+        for entry in snapshot:
+            lines.append(f'egress_cooldown_seconds{{egress="{entry["egress"]}",platform="{entry["platform"]}"}} '
+                         f'{entry["cooldown"]:.1f}')
+        lines += [
+            "# HELP egress_attempts_total Download attempts per egress, platform and outcome.",
+            "# TYPE egress_attempts_total counter",
+        ]
+        for entry in snapshot:
+            for outcome, count in entry["outcomes"].items():
+                lines.append(f'egress_attempts_total{{egress="{entry["egress"]}",platform="{entry["platform"]}",'
+                             f'outcome="{outcome}"}} {count}')
+        lines += [
+            "# HELP egress_in_flight Jobs currently running through an egress.",
+            "# TYPE egress_in_flight gauge",
+        ]
+        with self._lock:
+            for name, count in self._in_flight.items():
+                lines.append(f'egress_in_flight{{egress="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def parse_egress_pool(spec: str) -> List[Egress]:
+    """Parse a comma-separated list of egresses ("direct", proxy URLs or source addresses)."""
+    return [Egress.parse(item) for item in spec.split(",") if item.strip()]
+
+
+def parse_pacing(spec: str) -> Dict[str, float]:
+    """Parse per-platform pacing given as "instagram=2,tiktok=1" (seconds)."""
+    pacing = {}
+    for item in spec.split(","):
+        if "=" in item:
+            platform, interval = item.split("=", 1)
+            pacing[platform.strip().lower()] = float(interval)
+    return pacing
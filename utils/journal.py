@@ -0,0 +1,300 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import queue
+import logging
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+# Job stages in the order a job normally goes through them
+STAGE_RECEIVED = "received"
+STAGE_DOWNLOADING = "downloading"
+STAGE_PROCESSING = "processing"
+STAGE_UPLOADING = "uploading"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+
+FINAL_STAGES = (STAGE_DONE, STAGE_FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    update_key TEXT UNIQUE,
+    chat_id INTEGER NOT NULL,
+    status_msg_id INTEGER,
+    url TEXT NOT NULL,
+    source_type TEXT,
+    stage TEXT NOT NULL,
+    file_path TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Columns that may be changed by set_stage()
+_MUTABLE_FIELDS = ("status_msg_id", "source_type", "file_path", "attempts", "error")
+
+
+class JobJournal:
+    """
+    SQLite-backed journal of download jobs and the last processed update offset.
+
+    Writes are queued and committed in batches by a background thread, so
+    recording a stage change never waits on disk. Everything needed on the
+    request path (handled update keys, unfinished jobs, last offset) is kept
+    in memory and loaded once when the journal is opened.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5, batch_size: int = 64,
+                 retention_days: float = 7):
+        """
+        Args:
+            path: Path to the SQLite database file
+            flush_interval: Maximum delay in seconds before queued writes are committed
+            batch_size: Maximum number of writes committed in one transaction
+            retention_days: Finished jobs older than this are pruned on open
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._handled_keys = set()
+        self._unfinished: Dict[str, Dict[str, Any]] = {}
+        self._last_update_id: Optional[int] = None
+        self._pending_update_id: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def open(self) -> "JobJournal":
+        """Create the database if needed, load its state and start the writer thread."""
+        if self._thread is not None:
+            return self
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+            cutoff = time.time() - self.retention_days * 86400
+            conn.execute(
+                f"DELETE FROM jobs WHERE stage IN ({','.join('?' * len(FINAL_STAGES))}) AND updated_at < ?",
+                (*FINAL_STAGES, cutoff)
+            )
+            conn.commit()
+
+            for row in conn.execute("SELECT update_key FROM jobs WHERE update_key IS NOT NULL"):
+                self._handled_keys.add(row["update_key"])
+
+            placeholders = ','.join('?' * len(FINAL_STAGES))
+            for row in conn.execute(
+                f"SELECT * FROM jobs WHERE stage NOT IN ({placeholders}) ORDER BY created_at",
+                FINAL_STAGES
+            ):
+                self._unfinished[row["job_id"]] = dict(row)
+
+            row = conn.execute("SELECT value FROM state WHERE key = 'last_update_id'").fetchone()
+            if row:
+                self._last_update_id = int(row["value"])
+        finally:
+            conn.close()
+
+        self._thread = threading.Thread(target=self._writer, name="job-journal", daemon=True)
+        self._thread.start()
+        logger.info(
+            "Journal opened: %s (%d unfinished jobs, last update id %s)",
+            self.path, len(self._unfinished), self._last_update_id
+        )
+        return self
+
+    def close(self) -> None:
+        """Commit everything still queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Block until all writes queued so far are committed."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _writer(self) -> None:
+        conn = self._connect()
+        stop = False
+        try:
+            while not stop:
+                # Wait for the first write, then keep collecting until the
+                # batch is full, the flush interval expires or someone waits
+                item = self._queue.get()
+                batch = []
+                waiters = []
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is None:
+                        stop = True
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                        break
+                    if item:
+                        batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                self._commit(conn, batch)
+                for waiter in waiters:
+                    waiter.set()
+        finally:
+            conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        with self._lock:
+            pending_update_id = self._pending_update_id
+            self._pending_update_id = None
+        if not batch and pending_update_id is None:
+            return
+        try:
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+                if pending_update_id is not None:
+                    conn.execute(
+                        "INSERT INTO state (key, value) VALUES ('last_update_id', ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                        (str(pending_update_id),)
+                    )
+        except sqlite3.Error as e:
+            logger.error("Failed to commit %d journal entries: %s", len(batch), e)
+
+    # Update offsets
+
+    def last_update_id(self) -> Optional[int]:
+        """Return the id of the last update known to be fully processed."""
+        with self._lock:
+            return self._last_update_id
+
+    def record_offset(self, update_id: int) -> None:
+        """
+        Remember that every update up to and including update_id is processed.
+
+        Consecutive calls are coalesced, only the highest id reaches the disk.
+        """
+        with self._lock:
+            if self._last_update_id is not None and update_id <= self._last_update_id:
+                return
+            self._last_update_id = update_id
+            self._pending_update_id = update_id
+        self._queue.put(())
+
+    # Jobs
+
+    def is_handled(self, update_key: str) -> bool:
+        """Check whether a job was already created for this update."""
+        with self._lock:
+            return update_key in self._handled_keys
+
+    def create_job(self, chat_id: int, url: str, update_key: Optional[str] = None,
+                   source_type: Optional[str] = None, status_msg_id: Optional[int] = None) -> str:
+        """
+        Register a new job in the received stage.
+
+        Args:
+            chat_id: Chat the job belongs to
+            url: Cleaned video URL
+            update_key: Unique key of the originating update, used to skip redeliveries
+            source_type: Detected video platform
+            status_msg_id: Id of the status message shown to the user
+
+        Returns:
+            Id of the new job
+        """
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "update_key": update_key,
+            "chat_id": chat_id,
+            "status_msg_id": status_msg_id,
+            "url": url,
+            "source_type": source_type,
+            "stage": STAGE_RECEIVED,
+            "file_path": None,
+            "attempts": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._lock:
+            if update_key is not None:
+                self._handled_keys.add(update_key)
+            self._unfinished[job_id] = job
+        columns = ", ".join(job)
+        self._queue.put((
+            f"INSERT OR IGNORE INTO jobs ({columns}) VALUES ({', '.join('?' * len(job))})",
+            tuple(job.values())
+        ))
+        return job_id
+
+    def set_stage(self, job_id: str, stage: str, **fields: Any) -> None:
+        """
+        Move a job to another stage, optionally updating some of its fields.
+
+        Args:
+            job_id: Id of the job
+            stage: New stage
+            **fields: Any of status_msg_id, source_type, file_path, attempts, error
+        """
+        unknown = set(fields) - set(_MUTABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+
+        now = time.time()
+        with self._lock:
+            job = self._unfinished.get(job_id)
+            if job is not None:
+                job.update(fields, stage=stage, updated_at=now)
+                if stage in FINAL_STAGES:
+                    del self._unfinished[job_id]
+
+        assignments = ", ".join(f"{name} = ?" for name in ("stage", "updated_at", *fields))
+        self._queue.put((
+            f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+            (stage, now, *fields.values(), job_id)
+        ))
+
+    def unfinished_jobs(self) -> List[Dict[str, Any]]:
+        """Return copies of all jobs that have not reached a final stage, oldest first."""
+        with self._lock:
+            jobs = [dict(job) for job in self._unfinished.values()]
+        return sorted(jobs, key=lambda job: job["created_at"])
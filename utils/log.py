@@ -0,0 +1,191 @@
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+import contextvars
+import logging.handlers
+from contextlib import contextmanager
+from typing import Optional, Dict, Iterator, Callable, Any
+from concurrent.futures import Executor, Future
+
+# Structured fields attached to every record logged while they are set
+CONTEXT_FIELDS = ("job_id", "platform", "backend", "egress")
+
+_context: Dict[str, contextvars.ContextVar] = {
+    name: contextvars.ContextVar(name, default=None) for name in CONTEXT_FIELDS
+}
+
+# Attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+TEXT_FORMAT = '%(asctime)s | %(levelname)-8s | %(name)s:%(funcName)s:%(lineno)d - %(message)s'
+TEXT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+
+@contextmanager
+def log_context(**fields: Optional[str]) -> Iterator[None]:
+    """
+    Attach structured fields (job_id, platform, backend, egress) to records logged inside the block.
+
+    Context variables are not inherited by threads started inside the block,
+    submit executor work with submit_with_context() to keep the fields.
+    """
+    # Every field is set (to its current value if not given) so that values
+    # changed with set_log_context() inside the block are restored as well
+    tokens = [(var, var.set(fields.get(name, var.get()))) for name, var in _context.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def set_log_context(**fields: Optional[str]) -> None:
+    """
+    Set structured fields until the enclosing log_context() block ends.
+
+    Useful for fields that change several times inside one block, such as
+    the backend tried by a fallback chain.
+    """
+    for name, value in fields.items():
+        _context[name].set(value)
+
+
+def get_log_context() -> Dict[str, Optional[str]]:
+    """Current values of the structured fields, for bridging to other logging libraries."""
+    return {name: var.get() for name, var in _context.items()}
+
+
+def submit_with_context(executor: Executor, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """
+    Submit work to an executor so that it logs with the caller's context fields.
+
+    Executor threads do not inherit context variables; every task gets its
+    own copy, because one context cannot be entered by two threads at once.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the current log context onto the record, must run in the thread that logs it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, var in _context.items():
+            if not hasattr(record, name):
+                setattr(record, name, var.get())
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """
+    Keep the first DEBUG record of every message template, then one in `rate`.
+
+    Records of higher levels always pass.
+    """
+
+    def __init__(self, rate: int = 1):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._counts: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate == 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % self.rate:
+            return False
+        if count:
+            record.sampled = self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread.
+
+    The stock handler formats every record before enqueuing it, which is the
+    cost we want to move off the calling thread. The queue never leaves the
+    process, so records can be passed as they are.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = "INFO", fmt: str = "text", log_file: Optional[str] = None,
+                  debug_sample_rate: int = 1) -> None:
+    """
+    Route all logging through a queue drained by a background thread.
+
+    The calling thread only applies filters and enqueues the record;
+    formatting and disk or console writes happen in the listener thread.
+
+    Args:
+        level: Root logger level
+        fmt: "json" for structured records, "text" for the human-readable format
+        log_file: Optional path of a rotating log file
+        debug_sample_rate: Keep one in this many DEBUG records of each message
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT, TEXT_DATEFMT)
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(debug_sample_rate))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Write out queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
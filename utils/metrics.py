@@ -0,0 +1,39 @@
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def start_metrics_server(port: int, *renderers: Callable[[], str], host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve metrics in the Prometheus text format on /metrics from a background thread.
+
+    Args:
+        port: Port to listen on
+        renderers: Functions returning metrics text, concatenated on every scrape
+        host: Address to listen on
+
+    Returns:
+        The running server, stopped with shutdown()
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = "".join(render() for render in renderers).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics served on http://%s:%d/metrics", host, server.server_address[1])
+    return server
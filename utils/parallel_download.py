@@ -0,0 +1,341 @@
+import re
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Iterator
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.log import submit_with_context
+
+logger = logging.getLogger(__name__)
+
+# Protocols of single-file formats that can be split into byte ranges
+PROGRESSIVE_PROTOCOLS = ("http", "https")
+
+# Protocols of HLS formats, whose joined segments are an MPEG-TS stream
+HLS_PROTOCOLS = ("m3u8", "m3u8_native")
+
+_CONTENT_RANGE_RE = re.compile(r"bytes\s+\d+-\d+/(\d+)")
+
+# Attributes yt-dlp writes after every name=value pair of its "cookies" field
+_COOKIE_ATTRIBUTES = {"domain", "path", "secure", "expires", "max-age", "httponly", "samesite"}
+
+
+def cookie_header(cookies: Optional[str]) -> Optional[str]:
+    """
+    Turn the "cookies" field of a yt-dlp format into a Cookie header value.
+
+    yt-dlp keeps cookies out of http_headers and lists them as
+    "name=value; Domain=...; Path=...; Secure; Expires=..." instead.
+    """
+    if not cookies:
+        return None
+    pairs = []
+    for item in cookies.split(";"):
+        name, _, value = item.strip().partition("=")
+        if name and name.lower() not in _COOKIE_ATTRIBUTES:
+            pairs.append(f"{name}={value}")
+    return "; ".join(pairs) or None
+
+
+class BandwidthLimiter:
+    """Token bucket shared by all downloads to keep total throughput under a budget."""
+
+    def __init__(self, rate: float = 0, burst: Optional[float] = None):
+        """
+        Args:
+            rate: Allowed bytes per second, 0 disables the limit
+            burst: Maximum number of bytes that can be consumed at once
+        """
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        """Block until amount bytes may be transferred."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # Chunks larger than the bucket are allowed to drive it negative
+                if self._tokens >= min(amount, self.burst):
+                    self._tokens -= amount
+                    return
+                wait = (min(amount, self.burst) - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SourceAddressAdapter(HTTPAdapter):
+    """HTTP adapter binding outgoing connections, direct or to a proxy, to a local address."""
+
+    def __init__(self, source_address: Optional[str] = None, **kwargs):
+        self.source_address = source_address
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.source_address:
+            kwargs["source_address"] = (self.source_address, 0)
+        super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if self.source_address:
+            proxy_kwargs["source_address"] = (self.source_address, 0)
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+
+class SessionPool:
+    """
+    Keep-alive HTTP session shared across jobs with a cap on connections per host.
+    """
+
+    def __init__(self, per_host_connections: int = 8, verify: bool = True,
+                 headers: Optional[Dict[str, str]] = None, proxy: Optional[str] = None,
+                 source_address: Optional[str] = None):
+        """
+        Args:
+            per_host_connections: Maximum concurrent requests to a single host
+            verify: Whether to verify TLS certificates
+            headers: Default headers sent with every request
+            proxy: Proxy URL all requests go through
+            source_address: Local IP address outgoing connections are bound to
+        """
+        self.per_host_connections = per_host_connections
+        self.session = requests.Session()
+        self.session.verify = verify
+        # Egress settings are explicit, environment proxies would override them
+        self.session.trust_env = proxy is None and source_address is None
+        if headers:
+            self.session.headers.update(headers)
+        if proxy:
+            self.session.proxies = {"http": proxy, "https": proxy}
+
+        adapter = SourceAddressAdapter(
+            source_address, pool_connections=32, pool_maxsize=per_host_connections, max_retries=2
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def host_slot(self, url: str) -> Iterator[None]:
+        """Hold one of the connection slots of the URL's host."""
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = self._slots[host] = threading.BoundedSemaphore(self.per_host_connections)
+        with slot:
+            yield
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class ParallelDownloader:
+    """
+    Download engine using concurrent byte-range requests for progressive files
+    and concurrent fragment requests for DASH/HLS formats.
+    """
+
+    def __init__(self, pool: SessionPool, limiter: Optional[BandwidthLimiter] = None,
+                 workers: int = 4, chunk_size: int = 1024 * 1024, timeout: float = 30):
+        """
+        Args:
+            pool: Session pool shared between downloads
+            limiter: Global bandwidth budget
+            workers: Concurrent requests per download
+            chunk_size: Size of the byte ranges requested for progressive files
+            timeout: Connect/read timeout of each request in seconds
+        """
+        self.pool = pool
+        self.limiter = limiter or BandwidthLimiter()
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def _get(self, url: str, headers: Optional[Dict[str, str]] = None, stream: bool = True) -> requests.Response:
+        response = self.pool.session.get(url, headers=headers, stream=stream, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def _copy(self, response: requests.Response, fileobj) -> int:
+        written = 0
+        for block in response.iter_content(64 * 1024):
+            self.limiter.consume(len(block))
+            fileobj.write(block)
+            written += len(block)
+        return written
+
+    def _probe_size(self, url: str, headers: Dict[str, str]) -> Optional[int]:
+        """Return the file size if the server supports range requests."""
+        with self.pool.host_slot(url):
+            with self._get(url, headers={**headers, "Range": "bytes=0-0"}) as response:
+                if response.status_code != 206:
+                    return None
+                match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+                return int(match.group(1)) if match else None
+
+    def _fetch_range(self, url: str, headers: Dict[str, str], dest: str, start: int, end: int) -> int:
+        with self.pool.host_slot(url):
+            with self._get(url, headers={**headers, "Range": f"bytes={start}-{end}"}) as response:
+                if response.status_code != 206:
+                    raise IOError(f"Server ignored range request {start}-{end}")
+                with open(dest, "r+b") as f:
+                    f.seek(start)
+                    written = self._copy(response, f)
+        if written != end - start + 1:
+            raise IOError(f"Incomplete range {start}-{end}: got {written} bytes")
+        logger.debug("Fetched range %d-%d of %s", start, end, url)
+        return written
+
+    def download(self, url: str, dest: str, headers: Optional[Dict[str, str]] = None) -> int:
+        """
+        Download a progressive file, splitting it into concurrent range requests.
+
+        Falls back to a single stream when the server does not support ranges.
+
+        Args:
+            url: File URL
+            dest: Output path
+            headers: Extra request headers
+
+        Returns:
+            Number of bytes written
+        """
+        headers = headers or {}
+        size = self._probe_size(url, headers)
+
+        if not size or size <= self.chunk_size or self.workers <= 1:
+            with self.pool.host_slot(url):
+                with self._get(url, headers=headers) as response, open(dest, "wb") as f:
+                    return self._copy(response, f)
+
+        # Preallocate the file so ranges can be written in place
+        with open(dest, "wb") as f:
+            f.truncate(size)
+
+        ranges = [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [submit_with_context(executor, self._fetch_range, url, headers, dest, start, end)
+                       for start, end in ranges]
+            try:
+                return sum(future.result() for future in futures)
+            except BaseException:
+                # Do not wait for the remaining ranges of a download that already failed
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    def _fetch_fragment(self, url: str, headers: Dict[str, str]) -> bytes:
+        with self.pool.host_slot(url):
+            with self._get(url, headers=headers) as response:
+                parts = []
+                for block in response.iter_content(64 * 1024):
+                    self.limiter.consume(len(block))
+                    parts.append(block)
+        data = b"".join(parts)
+        logger.debug("Fetched fragment %s (%d bytes)", url, len(data))
+        return data
+
+    def download_fragments(self, urls: List[str], dest: str, headers: Optional[Dict[str, str]] = None) -> int:
+        """
+        Download fragments concurrently and write them to dest in order.
+
+        Args:
+            urls: Fragment URLs in playback order
+            dest: Output path
+            headers: Extra request headers
+
+        Returns:
+            Number of bytes written
+        """
+        headers = headers or {}
+        written = 0
+        # Keep a bounded window of fragments in flight so memory use stays flat
+        window = self.workers * 2
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, open(dest, "wb") as f:
+            pending = []
+            try:
+                for url in urls:
+                    pending.append(submit_with_context(executor, self._fetch_fragment, url, headers))
+                    if len(pending) >= window:
+                        written += f.write(pending.pop(0).result())
+                for future in pending:
+                    written += f.write(future.result())
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        return written
+
+    def _hls_fragments(self, url: str, headers: Dict[str, str]) -> Optional[List[str]]:
+        """Return segment URLs of a plain (unencrypted, media, whole-segment) HLS playlist."""
+        with self.pool.host_slot(url):
+            playlist = self._get(url, headers=headers, stream=False).text
+
+        segments = []
+        for line in playlist.splitlines():
+            line = line.strip()
+            if line.startswith("#EXT-X-STREAM-INF") or line.startswith("#EXT-X-MAP"):
+                return None
+            if line.startswith("#EXT-X-KEY") and "METHOD=NONE" not in line:
+                return None
+            # Segments that are byte ranges of a shared file would be fetched whole
+            if line.startswith("#EXT-X-BYTERANGE"):
+                return None
+            if line and not line.startswith("#"):
+                segments.append(urljoin(url, line))
+        return segments or None
+
+    def download_format(self, info: Dict[str, Any], dest: str) -> Optional[int]:
+        """
+        Download the format selected by yt-dlp.
+
+        Args:
+            info: yt-dlp info dict of a single video or of the selected format
+            dest: Output path
+
+        Returns:
+            Number of bytes written, or None if the format cannot be handled
+            by this engine (merged formats, encrypted, master or byte-range playlists)
+        """
+        if info.get("requested_formats"):
+            return None
+
+        url = info.get("url")
+        protocol = info.get("protocol", "")
+        headers = dict(info.get("http_headers") or {})
+        cookies = cookie_header(info.get("cookies"))
+        if cookies:
+            headers["Cookie"] = "; ".join(filter(None, (headers.get("Cookie"), cookies)))
+
+        if info.get("fragments"):
+            if any(fragment.get("byte_range") for fragment in info["fragments"]):
+                return None
+            base_url = info.get("fragment_base_url") or url or ""
+            urls = [fragment.get("url") or urljoin(base_url, fragment["path"]) for fragment in info["fragments"]]
+            return self.download_fragments(urls, dest, headers)
+
+        if not url:
+            return None
+
+        if protocol in HLS_PROTOCOLS:
+            urls = self._hls_fragments(url, headers)
+            if not urls:
+                return None
+            return self.download_fragments(urls, dest, headers)
+
+        if protocol in PROGRESSIVE_PROTOCOLS:
+            return self.download(url, dest, headers)
+
+        return None
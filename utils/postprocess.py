@@ -0,0 +1,257 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict, List
+
+from utils.log import submit_with_context
+from utils.prefetch import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+# Post-processing modes
+MODE_OFF = "off"            # Never touch downloaded files
+MODE_OVERSIZE = "oversize"  # Only process files above the size limit
+MODE_ALWAYS = "always"      # Remux every file to faststart MP4
+
+# Share of the size limit targeted by a re-encode, the rest is left for
+# container overhead and bitrate overshoot
+_SIZE_MARGIN = 0.92
+_AUDIO_BITRATE_KBPS = 96
+_MIN_VIDEO_BITRATE_KBPS = 150
+
+
+class VideoProcessor:
+    """
+    Remux videos to faststart MP4 and re-encode them to fit a size limit.
+
+    Work runs in a bounded pool of ffmpeg workers. Outputs are cached on disk
+    by source key and size limit, so each source is processed only once;
+    concurrent requests for the same source share one ffmpeg run. Callers
+    get a private link to the cached output, so eviction never removes a
+    file that is about to be sent.
+    """
+
+    def __init__(self, cache_path: str, max_workers: int = 2, cache_size_mb: float = 2048,
+                 ffmpeg: str = "ffmpeg", ffprobe: str = "ffprobe"):
+        """
+        Args:
+            cache_path: Directory holding processed outputs
+            max_workers: Maximum number of concurrent ffmpeg processes
+            cache_size_mb: Cache size above which the least recently used outputs are removed
+            ffmpeg: ffmpeg executable
+            ffprobe: ffprobe executable
+        """
+        self.cache_path = cache_path
+        self.cache_size_bytes = int(cache_size_mb * 1024 * 1024)
+        self.ffmpeg = shutil.which(ffmpeg)
+        self.ffprobe = shutil.which(ffprobe)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ffmpeg")
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._warned = False
+
+    @property
+    def available(self) -> bool:
+        if self.ffmpeg is None and not self._warned:
+            self._warned = True
+            logger.warning("ffmpeg not found, video post-processing is disabled")
+        return self.ffmpeg is not None
+
+    def will_process(self, size_bytes: int, max_size_bytes: int, mode: str = MODE_OVERSIZE) -> bool:
+        """Whether prepare() runs ffmpeg for a file of size_bytes."""
+        if mode == MODE_OFF or not self.available:
+            return False
+        return mode == MODE_ALWAYS or size_bytes > max_size_bytes
+
+    def _cache_file(self, key: str, max_size_bytes: int) -> str:
+        digest = hashlib.sha1(f"{key}|{max_size_bytes}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_path, f"{digest}.mp4")
+
+    def prepare(self, source_path: str, key: str, max_size_bytes: int, mode: str = MODE_OVERSIZE,
+                duration: Optional[float] = None) -> Optional[str]:
+        """
+        Return the file that should be sent for a downloaded video.
+
+        Args:
+            source_path: Downloaded video file
+            key: Stable identifier of the source used for caching
+            max_size_bytes: Size limit of the result
+            mode: One of MODE_OFF, MODE_OVERSIZE, MODE_ALWAYS
+            duration: Video duration in seconds, if known
+
+        Returns:
+            A private link to the processed file that the caller must delete,
+            the source itself when no processing is needed or possible, or None
+            if the video does not fit the limit
+        """
+        size = os.path.getsize(source_path)
+        too_large = size > max_size_bytes
+        if not self.will_process(size, max_size_bytes, mode):
+            return None if too_large else source_path
+
+        processed_path = self.process(source_path, key, max_size_bytes, duration)
+        if processed_path:
+            return processed_path
+        # Fall back to the source when remuxing failed but the source already fits
+        return None if too_large else source_path
+
+    def process(self, source_path: str, key: str, max_size_bytes: int,
+                duration: Optional[float] = None) -> Optional[str]:
+        """
+        Return a faststart MP4 version of source_path no larger than max_size_bytes.
+
+        Args:
+            source_path: Downloaded video file
+            key: Stable identifier of the source (e.g. cleaned URL) used for caching
+            max_size_bytes: Size limit of the result
+            duration: Video duration in seconds, probed with ffprobe if missing
+
+        Returns:
+            Path of a private link to the processed file next to source_path,
+            owned and deleted by the caller, or None if the video cannot be made to fit
+        """
+        if not self.available:
+            return None
+
+        output = self._cache_file(key, max_size_bytes)
+        with self._lock:
+            if os.path.exists(output):
+                logger.info("Using cached processed video for %s", key)
+                return self._checkout(output, source_path)
+
+            future = self._in_flight.get(output)
+            created = future is None
+            if created:
+                future = submit_with_context(self._executor, self._run, source_path, output, max_size_bytes, duration)
+                self._in_flight[output] = future
+
+        # A finished future runs the callback right away in this thread, so it
+        # must be added after the lock is released
+        if created:
+            future.add_done_callback(lambda _: self._forget(output))
+        if not future.result():
+            return None
+        with self._lock:
+            # Another job's eviction may have removed the output in the meantime
+            if not os.path.exists(output):
+                return None
+            return self._checkout(output, source_path)
+
+    def _checkout(self, output: str, source_path: str) -> str:
+        """Link a cached output next to source_path. Must be called with the lock held."""
+        # Refresh the modification time used for LRU eviction
+        os.utime(output)
+        dest = os.path.join(
+            os.path.dirname(source_path),
+            f"processed-{os.getpid()}-{threading.get_ident()}-{os.path.basename(output)}"
+        )
+        link_or_copy(output, dest)
+        return dest
+
+    def _forget(self, output: str) -> None:
+        with self._lock:
+            self._in_flight.pop(output, None)
+
+    def _run(self, source_path: str, output: str, max_size_bytes: int,
+             duration: Optional[float]) -> Optional[str]:
+        os.makedirs(self.cache_path, exist_ok=True)
+        partial = output + ".part"
+        try:
+            # Remuxing is cheap and is enough whenever the file already fits. If it
+            # fails, the caller sends the source as is rather than a re-encode
+            # sized for the limit, which could be far larger than the source
+            if os.path.getsize(source_path) <= max_size_bytes:
+                if self._ffmpeg(["-i", source_path, "-c", "copy", "-movflags", "+faststart"], partial) \
+                        and os.path.getsize(partial) <= max_size_bytes:
+                    return self._store(partial, output)
+                return None
+
+            duration = duration or self.probe_duration(source_path)
+            if not duration:
+                logger.warning("Cannot re-encode %s: unknown duration", source_path)
+                return None
+
+            target = max_size_bytes * _SIZE_MARGIN
+            for attempt in range(2):
+                video_kbps = int(target * 8 / duration / 1000) - _AUDIO_BITRATE_KBPS
+                if video_kbps < _MIN_VIDEO_BITRATE_KBPS:
+                    logger.warning("Cannot fit %.0f s video into %d bytes", duration, max_size_bytes)
+                    return None
+
+                logger.info("Re-encoding %s at %d kbit/s (attempt %d)", source_path, video_kbps, attempt + 1)
+                if not self._ffmpeg(self._encode_args(source_path, video_kbps), partial):
+                    return None
+                if os.path.getsize(partial) <= max_size_bytes:
+                    return self._store(partial, output)
+
+                # The encoder overshot, retry with the bitrate reduced by the overshoot
+                target *= max_size_bytes / os.path.getsize(partial) * _SIZE_MARGIN
+            return None
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    @staticmethod
+    def _encode_args(source_path: str, video_kbps: int) -> List[str]:
+        args = [
+            "-i", source_path,
+            "-c:v", "libx264", "-preset", "veryfast",
+            "-b:v", f"{video_kbps}k", "-maxrate", f"{video_kbps}k", "-bufsize", f"{video_kbps * 2}k",
+            "-c:a", "aac", "-b:a", f"{_AUDIO_BITRATE_KBPS}k",
+            "-movflags", "+faststart",
+        ]
+        # Low bitrates look better at a lower resolution
+        if video_kbps < 1000:
+            args[2:2] = ["-vf", "scale=-2:'min(720,ih)'"]
+        return args
+
+    def _ffmpeg(self, args: List[str], output: str) -> bool:
+        cmd = [self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error", *args, "-f", "mp4", output]
+        process = subprocess.run(cmd, capture_output=True, text=True)
+        if process.returncode != 0:
+            logger.error("ffmpeg failed: %s", process.stderr.strip()[-500:])
+            return False
+        return True
+
+    def _store(self, partial: str, output: str) -> str:
+        with self._lock:
+            os.replace(partial, output)
+            self._evict()
+        return output
+
+    def _evict(self) -> None:
+        """Remove least recently used outputs while the cache is over budget."""
+        files = []
+        for name in os.listdir(self.cache_path):
+            if not name.endswith(".mp4"):
+                continue
+            path = os.path.join(self.cache_path, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        # Senders hold their own links, but the newest file is still to be checked out
+        for _, size, path in sorted(files)[:-1]:
+            if total <= self.cache_size_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def probe_duration(self, path: str) -> Optional[float]:
+        """Return the duration of a media file in seconds using ffprobe."""
+        if not self.ffprobe:
+            return None
+        cmd = [self.ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "json", path]
+        process = subprocess.run(cmd, capture_output=True, text=True)
+        try:
+            return float(json.loads(process.stdout)["format"]["duration"])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,279 @@
+import os
+import time
+import shutil
+import threading
+import logging
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Deque, Iterator, Callable, List
+
+from utils.log import log_context
+
+logger = logging.getLogger(__name__)
+
+
+class TrendTracker:
+    """Count requests per video key over a sliding time window."""
+
+    def __init__(self, window: float = 3600, threshold: int = 3, max_keys: int = 10000):
+        """
+        Args:
+            window: Length of the sliding window in seconds
+            threshold: Requests within the window that make a video trending
+            max_keys: Maximum number of tracked keys, the least recently requested are dropped
+        """
+        self.window = window
+        self.threshold = threshold
+        self.max_keys = max_keys
+        self._hits: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, hits: Deque[float], now: float) -> None:
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+    def record(self, key: str) -> int:
+        """Register a request for key and return its count within the window."""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.pop(key, None) or deque()
+            self._expire(hits, now)
+            hits.append(now)
+            self._hits[key] = hits
+            while len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+            return len(hits)
+
+    def count(self, key: str) -> int:
+        with self._lock:
+            hits = self._hits.get(key)
+            if not hits:
+                return 0
+            self._expire(hits, time.monotonic())
+            return len(hits)
+
+    def is_trending(self, key: str) -> bool:
+        return self.count(key) >= self.threshold
+
+
+class MediaStore:
+    """
+    Local store of video files and extraction metadata keyed by video key.
+
+    Files are evicted least recently used first when the store exceeds its
+    disk budget. Files are handed out as hard links (or copies on filesystems
+    without links), so callers can delete them after use.
+    """
+
+    def __init__(self, path: str, budget_bytes: int, metadata_ttl: float = 600):
+        """
+        Args:
+            path: Store directory
+            budget_bytes: Disk budget of the stored files
+            metadata_ttl: Seconds after which stored metadata is considered stale
+        """
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self.metadata_ttl = metadata_ttl
+        self._metadata: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key.replace(":", "_").replace("/", "_") + ".mp4")
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(self._file(key))
+
+    def checkout(self, key: str, dest_dir: str) -> Optional[str]:
+        """
+        Give out a private link to the stored file of key.
+
+        Returns:
+            Path inside dest_dir that the caller owns, or None if key is not stored
+        """
+        source = self._file(key)
+        dest = os.path.join(dest_dir, f"warm-{os.getpid()}-{threading.get_ident()}-{os.path.basename(source)}")
+        with self._lock:
+            if not os.path.exists(source):
+                return None
+            os.utime(source)
+            link_or_copy(source, dest)
+        return dest
+
+    def put(self, key: str, file_path: str) -> Optional[str]:
+        """Store a file under key, keeping file_path untouched. Returns the stored path."""
+        size = os.path.getsize(file_path)
+        if size > self.budget_bytes:
+            return None
+        target = self._file(key)
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            partial = target + ".part"
+            link_or_copy(file_path, partial)
+            os.replace(partial, target)
+            self._evict(keep=target)
+        return target
+
+    def _evict(self, keep: str) -> None:
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.path != keep:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+        for _, size, path in sorted(entries):
+            if total <= self.budget_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def get_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._metadata.get(key)
+        return entry[1] if entry else None
+
+    def metadata_is_fresh(self, key: str) -> bool:
+        entry = self._metadata.get(key)
+        return entry is not None and time.monotonic() - entry[0] < self.metadata_ttl
+
+    def put_metadata(self, key: str, metadata: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._metadata[key] = (now, metadata)
+            # Metadata far past its TTL will not be served anymore
+            for stale_key in [k for k, (fetched, _) in self._metadata.items() if now - fetched > self.metadata_ttl * 10]:
+                del self._metadata[stale_key]
+
+
+def link_or_copy(source: str, dest: str) -> None:
+    """Hard-link source to dest, copying it where links are not supported."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+class Prefetcher:
+    """
+    Keep trending videos warm in a MediaStore.
+
+    Every user request is recorded with `record`. Once a video crosses the
+    trending threshold it is queued for a background refresh of its
+    extraction metadata and, if missing, a download into the store. The
+    worker only runs while no user job is in flight and its downloads go
+    through a registry configured with the prefetch bandwidth budget.
+    """
+
+    def __init__(self, store: MediaStore, tracker: TrendTracker,
+                 download: Callable[[str, str, str], Optional[Any]],
+                 resolve: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None,
+                 temp_path: str = "temp", max_queue: int = 32):
+        """
+        Args:
+            store: Store for the prefetched files and metadata
+            tracker: Request frequency tracker
+            download: Function (url, platform, output_dir) returning a DownloadResult
+            resolve: Function returning fresh extraction metadata for a URL
+            temp_path: Directory for in-progress downloads
+            max_queue: Maximum number of queued videos
+        """
+        self.store = store
+        self.tracker = tracker
+        self._download = download
+        self._resolve = resolve
+        self.temp_path = temp_path
+        self.max_queue = max_queue
+
+        self._queue: "OrderedDict[str, tuple]" = OrderedDict()
+        self._active_jobs = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def start(self) -> "Prefetcher":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, name="prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def record(self, key: str, url: str, platform: str) -> int:
+        """Register a user request; queue the video once it is trending. Returns the request count."""
+        count = self.tracker.record(key)
+        if count >= self.tracker.threshold:
+            needs_media = not self.store.has(key)
+            needs_metadata = self._resolve is not None and not self.store.metadata_is_fresh(key)
+            if needs_media or needs_metadata:
+                with self._condition:
+                    if key not in self._queue and len(self._queue) < self.max_queue:
+                        logger.info("Video %s is trending (%d requests), queued for prefetch", key, count)
+                        self._queue[key] = (url, platform)
+                        self._condition.notify()
+        return count
+
+    @contextmanager
+    def user_job(self) -> Iterator[None]:
+        """Mark a user-initiated job as running, prefetching waits until none are."""
+        with self._condition:
+            self._active_jobs += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active_jobs -= 1
+                self._condition.notify_all()
+
+    def pending(self) -> List[str]:
+        with self._condition:
+            return list(self._queue)
+
+    def _next(self) -> Optional[tuple]:
+        with self._condition:
+            while not self._stopped and (not self._queue or self._active_jobs):
+                self._condition.wait()
+            if self._stopped:
+                return None
+            return self._queue.popitem(last=False)
+
+    def _worker(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            key, (url, platform) = item
+            # Prefetch work is not part of a user job, it is logged under its own job id
+            with log_context(job_id=f"prefetch:{key}", platform=platform, backend=None, egress=None):
+                try:
+                    self.refresh(key, url, platform)
+                except Exception as e:
+                    logger.error("Prefetch of %s failed: %s", key, e)
+
+    def refresh(self, key: str, url: str, platform: str) -> None:
+        """Refresh the metadata of a video and make sure its file is stored."""
+        if self._resolve is not None and not self.store.metadata_is_fresh(key):
+            metadata = self._resolve(url)
+            if metadata:
+                self.store.put_metadata(key, metadata)
+
+        if self.store.has(key):
+            return
+
+        expected = (self.store.get_metadata(key) or {}).get("filesize")
+        if expected and expected > self.store.budget_bytes:
+            logger.info("Skipping prefetch of %s: %d bytes exceed the store budget", key, expected)
+            return
+
+        start = time.monotonic()
+        result = self._download(url, platform, self.temp_path)
+        if not result:
+            return
+        try:
+            if self.store.put(key, result.file_path):
+                logger.info("Prefetched %s in %.1f s", key, time.monotonic() - start)
+        finally:
+            os.remove(result.file_path)
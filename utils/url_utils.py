@@ -1,4 +1,6 @@
 import re
+import threading
+from collections import OrderedDict
 from typing import Optional, List
 from config import settings
 
@@ -76,4 +78,94 @@ def get_clean_url(url: str) -> Optional[str]:
                 return f"https://youtu.be/{video_id}"
     
     # If no specific cleaning rules matched, return the original URL
-    return url 
\ No newline at end of file
+    return url
+
+
+# Patterns extracting the video ID, in the order they are tried
+_VIDEO_ID_PATTERNS = [
+    ('youtube', re.compile(r'(?:youtube\.com/(?:shorts/|embed/|watch\?(?:[^#]*&)?v=)|youtu\.be/)([a-zA-Z0-9_-]{6,})')),
+    ('instagram', re.compile(r'instagram\.com/(?:[^/?#]+/)?(?:reels?|p|tv)/([a-zA-Z0-9_-]+)')),
+    ('tiktok', re.compile(r'tiktok\.com/(?:@[^/?#]+/video|v)/(\d+)')),
+]
+
+# Share links that only carry a short code and redirect to the video page
+_SHORT_LINK_RE = re.compile(r'https?://(?:(?:vm|vt)\.tiktok\.com/|(?:www\.)?tiktok\.com/t/)[a-zA-Z0-9]+')
+
+
+# Successfully resolved short links, failures are retried on the next request
+_RESOLVED_MAX = 4096
+_resolved: "OrderedDict[str, str]" = OrderedDict()
+_resolved_lock = threading.Lock()
+
+
+def is_short_link(url: str) -> bool:
+    """
+    Check if the URL is a short share link that only carries a code.
+    
+    Args:
+        url: URL to check
+        
+    Returns:
+        True if the video ID can only be found by following the link's redirect
+    """
+    return bool(_SHORT_LINK_RE.match(url))
+
+
+def resolve_short_link(url: str, timeout: float = 5, session=None) -> str:
+    """
+    Follow the redirect of a short share link to the video page.
+    
+    Args:
+        url: URL, returned unchanged unless it is a known short link
+        timeout: Request timeout in seconds
+        session: requests session to send the request through (e.g. bound to an egress)
+        
+    Returns:
+        The final URL, or url itself if it is not a short link or cannot be resolved
+    """
+    if not is_short_link(url):
+        return url
+    with _resolved_lock:
+        if url in _resolved:
+            _resolved.move_to_end(url)
+            return _resolved[url]
+
+    import requests
+    try:
+        with (session or requests).get(url, allow_redirects=True, stream=True, timeout=timeout) as response:
+            if response.status_code >= 400 or not response.url:
+                return url
+            resolved = response.url
+    except requests.RequestException:
+        return url
+
+    with _resolved_lock:
+        _resolved[url] = resolved
+        while len(_resolved) > _RESOLVED_MAX:
+            _resolved.popitem(last=False)
+    return resolved
+
+
+def get_video_key(url: str, resolve: bool = False) -> Optional[str]:
+    """
+    Get a canonical key identifying the video behind a URL.
+    
+    Different URL forms of the same video (shorts, watch, youtu.be, tracking
+    parameters) map to the same key. Short share links (vm.tiktok.com,
+    tiktok.com/t/) only carry a code, so they are recognized only when
+    resolve is set and their redirect leads to the video.
+    
+    Args:
+        url: Video URL
+        resolve: Follow the redirect of short share links (a network request, cached on success)
+        
+    Returns:
+        Key in the form "platform:video_id", or None if the URL is not recognized
+    """
+    if resolve:
+        url = resolve_short_link(url)
+    for platform, pattern in _VIDEO_ID_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return f"{platform}:{match.group(1)}"
+    return None